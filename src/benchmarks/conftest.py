@@ -0,0 +1,60 @@
+from functools import lru_cache
+
+import numpy as np
+import pytest
+
+from custom_code.brokers.antares_transport import make_synthetic_loci
+from custom_code.ghost import GhostCatalog
+from custom_code.models import ProjectTargetList, QuerySet
+
+LOCI_COUNTS = [
+    100,
+    pytest.param(10_000, marks=pytest.mark.slow),
+    pytest.param(100_000, marks=pytest.mark.slow),
+]
+
+
+@lru_cache(maxsize=None)
+def synthetic_loci(n_loci):
+    return make_synthetic_loci(n_loci, n_alerts=10)
+
+
+def rounds_for(n_loci):
+    """Fewer rounds for the larger, slower benchmarks."""
+    return 5 if n_loci <= 1000 else 1
+
+
+@pytest.fixture(params=LOCI_COUNTS)
+def n_loci(request):
+    return request.param
+
+
+@pytest.fixture
+def loci(n_loci):
+    return synthetic_loci(n_loci)
+
+
+@pytest.fixture
+def project(db):
+    project = ProjectTargetList.objects.create(name='benchmark', tns=False)
+    QuerySet.objects.create(name='qs_benchmark', project=project)
+    return project
+
+
+def synthetic_ghost_catalog(loci, matched_fraction=0.9):
+    """GHOST catalog with a transient at the position of the first
+    matched_fraction of loci, under names that do not match, so that
+    host association exercises the coordinate cross-match.
+    """
+    n = int(len(loci) * matched_fraction)
+    ra = np.array([locus.ra for locus in loci[:n]])
+    dec = np.array([locus.dec for locus in loci[:n]])
+    return GhostCatalog({
+        'TransientName': np.array([f'SNbench{i}' for i in range(n)]),
+        'TransientRA': ra,
+        'TransientDEC': dec,
+        'objID': np.arange(n) + 1,
+        'NED_name': np.array([f'BENCH-HOST-{i}' for i in range(n)]),
+        'raMean': ra,
+        'decMean': dec,
+    })
@@ -0,0 +1,17 @@
+"""
+Settings for the ingest benchmark suite: the project settings with
+a throwaway MEDIA_ROOT and the offline ANTARES transport.
+"""
+import os
+import tempfile
+
+os.environ.setdefault('TNS_APIKEY', '')
+
+from mytom.settings import *  # noqa
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='vtda-benchmarks-')
+
+ANTARES_TRANSPORT = 'custom_code.brokers.antares_transport.FakeAntaresTransport'
+
+# benchmark the ingest itself, not the filters run on every saved target
+HOOKS = dict(HOOKS, target_post_save='tom_common.hooks.target_post_save')  # noqa
@@ -0,0 +1,94 @@
+import pandas as pd
+import pytest
+from tom_dataproducts.models import ReducedDatum
+from tom_targets.models import Target
+
+from benchmarks.conftest import rounds_for, synthetic_ghost_catalog
+from custom_code import filter_helper
+from custom_code.brokers.antares_complete import ANTARESBroker
+from custom_code.brokers.antares_transport import FakeAntaresTransport
+from custom_code.models import HostGalaxy, PhotometrySyncState, TargetAux
+
+
+def make_targets(loci):
+    return Target.objects.bulk_create([
+        Target(name=locus.properties['ztf_object_id'], type='SIDEREAL', ra=locus.ra, dec=locus.dec)
+        for locus in loci
+    ])
+
+
+def test_fetch_alerts(benchmark, loci):
+    broker = ANTARESBroker(transport=FakeAntaresTransport(loci, page_size=100))
+    parameters = {'tag': ['benchmark'], 'max_alerts': len(loci)}
+
+    alerts = benchmark(lambda: list(broker.fetch_alerts(parameters)))
+    assert len(alerts) == len(loci)
+
+
+def test_fetch_alerts_first_alert(benchmark, loci):
+    transport = FakeAntaresTransport(loci, page_size=25)
+    broker = ANTARESBroker(transport=transport)
+    parameters = {'tag': ['benchmark'], 'max_alerts': len(loci)}
+
+    def first_alert():
+        transport.n_search_pages = 0
+        return next(broker.fetch_alerts(parameters))
+
+    alert = benchmark(first_alert)
+    assert alert['locus_id'] == loci[0].locus_id
+    assert transport.n_search_pages == 1
+
+
+def test_save_alerts_to_group(benchmark, loci, project):
+    broker = ANTARESBroker(transport=FakeAntaresTransport(loci, page_size=100))
+
+    def setup():
+        Target.objects.all().delete()
+
+    n_alerts = benchmark.pedantic(
+        filter_helper.save_alerts_to_group,
+        args=(project, broker),
+        kwargs={'max_alerts': len(loci)},
+        setup=setup,
+        rounds=rounds_for(len(loci)),
+    )
+    assert n_alerts == len(loci)
+    assert project.targets.count() == len(loci)
+
+
+@pytest.mark.django_db
+def test_process_reduced_data(benchmark, loci):
+    targets = make_targets(loci)
+    broker = ANTARESBroker(transport=FakeAntaresTransport(loci))
+
+    def setup():
+        ReducedDatum.objects.all().delete()
+        PhotometrySyncState.objects.all().delete()
+
+    def process_all():
+        return sum(broker.process_reduced_data(target, alert=locus) for target, locus in zip(targets, loci))
+
+    n_datums = benchmark.pedantic(process_all, setup=setup, rounds=rounds_for(len(loci)))
+    assert n_datums == sum(len(locus.alerts) for locus in loci)
+
+
+@pytest.mark.django_db
+def test_update_all_hosts(benchmark, loci, monkeypatch):
+    make_targets(loci)
+    catalog = synthetic_ghost_catalog(loci)
+    # the remainder would go to the GHOST web search; find nothing instead
+    monkeypatch.setattr(
+        filter_helper, 'getTransientHosts', lambda **kwargs: pd.DataFrame(columns=['TransientName'])
+    )
+
+    def setup():
+        TargetAux.objects.update(host=None)
+        HostGalaxy.objects.all().delete()
+
+    stats = benchmark.pedantic(
+        filter_helper.update_all_hosts,
+        kwargs={'catalog': catalog},
+        setup=setup,
+        rounds=rounds_for(len(loci)),
+    )
+    assert stats['coord_matched'] == len(catalog)
@@ -1,34 +1,34 @@
 import logging
+from datetime import timezone
 
-import antares_client
 import marshmallow
+import numpy as np
 import requests
-from antares_client.search import get_by_ztf_object_id
 from astropy.time import Time, TimezoneInfo
 from crispy_forms.layout import Div, Fieldset, Layout, HTML
 from django import forms
+from django.db import transaction
 from tom_alerts.alerts import GenericBroker, GenericQueryForm, GenericAlert
 from tom_dataproducts.models import ReducedDatum
 from tom_targets.models import Target, TargetName
 
+from custom_code.brokers.antares_tags import ANTARES_TAG_URL, fetch_tags, get_tag_catalog, get_tag_choices
+from custom_code.brokers.antares_transport import get_transport
+from custom_code.lightcurves import PACKED_LIGHTCURVES, update_packed_lightcurve
+from custom_code.models import PhotometrySyncState
+from custom_code.project_summary import SN_TYPE_EXTRA
+
 logger = logging.getLogger(__name__)
 
 ANTARES_BASE_URL = 'https://antares.noirlab.edu'
 ANTARES_API_URL = 'https://api.antares.noirlab.edu'
-ANTARES_TAG_URL = ANTARES_API_URL + '/v1/tags'
 
 
 def get_available_tags(url: str = ANTARES_TAG_URL):
-    response = requests.get(url).json()
-    tags = response.get('data', {})
-    if response.get('links', {}).get('next'):
-        return tags + get_available_tags(response['links']['next'])
-    return tags
-
-
-def get_tag_choices():
-    tags = get_available_tags()
-    return [(s['id'], s['id']) for s in tags]
+    """All ANTARES tags, from the cached tag catalog."""
+    if url != ANTARES_TAG_URL:
+        return fetch_tags(url)
+    return get_tag_catalog()
 
 
 class ANTARESBrokerForm(GenericQueryForm):
@@ -258,6 +258,11 @@ class ANTARESBroker(GenericBroker):
     name = 'ANTARES'
     form = ANTARESBrokerForm
 
+    def __init__(self, *args, transport=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # where loci come from; the live API unless settings.ANTARES_TRANSPORT says otherwise
+        self.transport = transport if transport is not None else get_transport()
+
     @classmethod
     def alert_to_dict(cls, locus):
         """
@@ -281,7 +286,57 @@ class ANTARESBroker(GenericBroker):
             } for alert in locus.alerts]
         }
 
+    @classmethod
+    def alert_to_summary(cls, locus):
+        """Like alert_to_dict, but only the newest alert is kept, which is
+        all to_generic_alert needs; the other alerts are not copied.
+        """
+        newest = locus.alerts[-1] if locus.alerts else None
+        return {
+            'locus_id': locus.locus_id,
+            'ra': locus.ra,
+            'dec': locus.dec,
+            'properties': locus.properties,
+            'tags': locus.tags,
+            'catalogs': locus.catalogs,
+            'alerts': [] if newest is None else [{
+                'alert_id': newest.alert_id,
+                'mjd': newest.mjd,
+                'properties': newest.properties
+            }]
+        }
+
     def fetch_alerts(self, parameters: dict) -> iter:
+        """Stream up to max_alerts matching loci as dicts. Result pages are
+        requested only as the iterator is consumed; the first one is fetched
+        here so that query errors surface to the caller. Unless
+        parameters['summary'] is False, dicts come from alert_to_summary.
+        """
+        max_alerts = parameters.get('max_alerts', 20)
+        to_dict = self.alert_to_summary if parameters.get('summary', True) else self.alert_to_dict
+        loci = self.transport.search(self.build_query(parameters))
+        try:
+            first = next(loci)
+        except (marshmallow.exceptions.ValidationError, StopIteration):
+            return iter(())
+        return self._stream_alerts(first, loci, max_alerts, to_dict)
+
+    def _stream_alerts(self, first, loci, max_alerts, to_dict):
+        if max_alerts < 1:
+            return
+        yield to_dict(first)
+        for _ in range(max_alerts - 1):
+            try:
+                locus = next(loci)
+            except StopIteration:
+                return
+            except (marshmallow.exceptions.ValidationError, requests.exceptions.RequestException) as e:
+                logger.warning("Stopped reading ANTARES results early: %s", e)
+                return
+            yield to_dict(locus)
+
+    def build_query(self, parameters: dict) -> dict:
+        """ElasticSearch query for the broker form parameters."""
         tags = parameters.get('tag')
         nobs_gt = parameters.get('nobs__gt')
         nobs_lt = parameters.get('nobs__lt')
@@ -294,7 +349,6 @@ class ANTARESBroker(GenericBroker):
         mag_max = parameters.get('mag__max')
         elsquery = parameters.get('esquery')
         ztfid = parameters.get('ztfid')
-        max_alerts = parameters.get('max_alerts', 20)
         if ztfid:
             query = {
                 "query": {
@@ -357,52 +411,104 @@ class ANTARESBroker(GenericBroker):
                 }
             }
 
-        loci = antares_client.search.search(query)
-        #        if ztfid:
-        #            loci = get_by_ztf_object_id(ztfid)
-        alerts = []
-        while len(alerts) < max_alerts:
-            try:
-                locus = next(loci)
-            except (marshmallow.exceptions.ValidationError, StopIteration):
-                break
-            alerts.append(self.alert_to_dict(locus))
-        return iter(alerts)
+        return query
 
     def fetch_alert(self, id):
-        alert = get_by_ztf_object_id(id)
+        alert = self.transport.get_by_ztf_object_id(id)
         return alert
 
-    # TODO: This function
+    def fetch_reduced_data(self, target):
+        """Network half of process_reduced_data, safe to run off the
+        main thread. Pass the result back as process_reduced_data's alert.
+        """
+        return self.fetch_alert(target.name)
+
+    @staticmethod
+    def alert_to_photometry(properties):
+        """ReducedDatum value for an alert's properties."""
+        if 'ant_mag' in properties:
+            return {
+                'filter': properties['ant_passband'],
+                'magnitude': properties['ant_mag'],
+                'error': properties['ant_magerr'],
+            }
+        return {
+            'filter': properties['ant_passband'],
+            'limit': properties['ant_maglim'],
+        }
+
     def process_reduced_data(self, target, alert=None):
         """Implemented in this version, NOT in the original ANTARES filter.
+        alert may be the target's locus, if already fetched. Anything
+        else, such as the alert dict tom_alerts passes when creating a
+        target, is ignored and the locus is fetched.
+
+        Only alerts newer than the target's PhotometrySyncState watermark
+        are processed; delete the watermark to force a full rebuild.
+        Existing photometry is read with one query and new points are
+        written with one bulk_create, so re-running is idempotent.
+        New points are also merged into the target's PackedLightcurve.
+        Returns the number of new ReducedDatum rows, 0 for targets
+        ANTARES does not know.
         """
         oid = target.name
-        alerts = self.fetch_alert(oid).alerts
-
-        for alert in alerts:
-            mjd = Time(alert.mjd, format='mjd', scale='utc')
-            properties = alert.properties
-            is_upper_lim = 'ant_mag' not in properties
-            if not is_upper_lim:
-                value = {
-                    'filter': properties['ant_passband'],
-                    'magnitude': properties['ant_mag'],
-                    'error': properties['ant_magerr'],
-                }
-            else:
-                value = {
-                    'filter': properties['ant_passband'],
-                    'limit': properties['ant_maglim'],
-                }
-            ReducedDatum.objects.get_or_create(
-                timestamp=mjd.to_datetime(TimezoneInfo()),
+        locus = alert if hasattr(alert, 'alerts') else self.fetch_alert(oid)
+        if locus is None:
+            return 0
+        sync_state, _ = PhotometrySyncState.objects.get_or_create(
+            target=target, source_name=self.name
+        )
+        alerts = [
+            alert for alert in locus.alerts
+            if sync_state.last_mjd is None or alert.mjd > sync_state.last_mjd
+        ]
+        if not alerts:
+            return 0
+
+        # naive UTC conversion is vectorized; passing timezone= converts per element
+        timestamps = [
+            timestamp.replace(tzinfo=timezone.utc)
+            for timestamp in Time(
+                np.array([alert.mjd for alert in alerts], dtype=float), format='mjd', scale='utc'
+            ).to_datetime()
+        ]
+
+        existing = set(
+            ReducedDatum.objects.filter(
+                target=target,
+                source_name=self.name,
+                data_type='photometry',
+                timestamp__gte=min(timestamps)
+            ).values_list('timestamp', 'value__filter')
+        )
+
+        new_datums = []
+        for alert, timestamp in zip(alerts, timestamps):
+            value = self.alert_to_photometry(alert.properties)
+            key = (timestamp, value['filter'])
+            if key in existing:
+                continue
+            existing.add(key)
+            new_datums.append(ReducedDatum(
+                timestamp=timestamp,
                 value=value,
                 source_name=self.name,
                 source_location=oid,
                 data_type='photometry',
                 target=target
-            )
+            ))
+
+        newest = max(alerts, key=lambda alert: alert.mjd)
+        with transaction.atomic():
+            ReducedDatum.objects.bulk_create(new_datums)
+            if PACKED_LIGHTCURVES:
+                update_packed_lightcurve(target, self.name, [
+                    (target.id, datum.timestamp, datum.value) for datum in new_datums
+                ])
+            sync_state.last_mjd = newest.mjd
+            sync_state.last_alert_id = newest.alert_id
+            sync_state.save()
+        return len(new_datums)
 
     def to_target(self, alert: dict) -> Target:
         target = Target.objects.create(
@@ -415,7 +521,10 @@ class ANTARESBroker(GenericBroker):
         aliases = [antares_name]
         if alert['properties'].get('horizons_targetname'):  # TODO: review if any other target names need to be created
             aliases.append(TargetName(name=alert['properties'].get('horizons_targetname')))
-        return target, [], aliases
+        extras = {}
+        if alert['properties'].get(SN_TYPE_EXTRA):
+            extras[SN_TYPE_EXTRA] = alert['properties'][SN_TYPE_EXTRA]
+        return target, extras, aliases
 
     def to_generic_alert(self, alert):
         url = f"{ANTARES_BASE_URL}/loci/{alert['locus_id']}"
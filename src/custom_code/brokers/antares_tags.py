@@ -0,0 +1,85 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from custom_code.http_client import get_http_client
+
+ANTARES_TAG_URL = 'https://api.antares.noirlab.edu/v1/tags'
+TAG_CACHE_KEY = 'antares_tag_catalog'
+TAG_CATALOG_TTL = getattr(settings, 'ANTARES_TAG_TTL', 3600)
+TAG_RETRY_DELAY = 60
+
+logger = logging.getLogger(__name__)
+
+_refresh_lock = threading.Lock()
+_retry_after = 0.
+
+
+def fetch_tags(url=ANTARES_TAG_URL):
+    """Follow the links.next chain of the ANTARES tag listing
+    iteratively and return all tag records.
+    """
+    client = get_http_client()
+    tags = []
+    while url:
+        response = client.get(url)
+        response.raise_for_status()
+        page = response.json()
+        tags.extend(page.get('data', []))
+        url = page.get('links', {}).get('next')
+    return tags
+
+
+def refresh_tag_catalog():
+    """Fetch the tag listing and store it in the cache without expiry,
+    so an old copy stays available when ANTARES cannot be reached.
+    """
+    tags = fetch_tags()
+    cache.set(TAG_CACHE_KEY, {'tags': tags, 'fetched': time.time()}, None)
+    return tags
+
+
+def _refresh_in_background():
+    if time.time() < _retry_after or not _refresh_lock.acquire(blocking=False):
+        return  # a refresh is already running or failed recently
+
+    def run():
+        global _retry_after
+        try:
+            refresh_tag_catalog()
+        except Exception as e:
+            _retry_after = time.time() + TAG_RETRY_DELAY
+            logger.warning("Could not refresh the ANTARES tag catalog: %s", e)
+        finally:
+            _refresh_lock.release()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def get_tag_catalog():
+    """Cached ANTARES tag records. A copy older than TAG_CATALOG_TTL is
+    returned as is while a background thread refreshes it. Only an empty
+    cache blocks on the network; if that fails, no tags are returned and
+    the fetch is not retried for TAG_RETRY_DELAY seconds.
+    """
+    global _retry_after
+    entry = cache.get(TAG_CACHE_KEY)
+    if entry is None:
+        if time.time() < _retry_after:
+            return []
+        try:
+            return refresh_tag_catalog()
+        except Exception as e:
+            _retry_after = time.time() + TAG_RETRY_DELAY
+            logger.warning("ANTARES tag catalog unavailable: %s", e)
+            return []
+    if time.time() - entry['fetched'] > TAG_CATALOG_TTL:
+        _refresh_in_background()
+    return entry['tags']
+
+
+def get_tag_choices():
+    return [(s['id'], s['id']) for s in get_tag_catalog()]
@@ -0,0 +1,135 @@
+import json
+import time
+
+import antares_client
+import numpy as np
+from antares_client.search import get_by_ztf_object_id
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_TRANSPORT = 'custom_code.brokers.antares_transport.AntaresClientTransport'
+
+
+class AntaresClientTransport:
+    """Transport backed by the live ANTARES API through antares_client."""
+
+    def search(self, query):
+        return antares_client.search.search(query)
+
+    def get_by_ztf_object_id(self, ztf_object_id):
+        return get_by_ztf_object_id(ztf_object_id)
+
+
+class FakeAlert:
+    """Stand-in for antares_client.models.Alert."""
+
+    def __init__(self, alert_id, mjd, properties):
+        self.alert_id = alert_id
+        self.mjd = mjd
+        self.properties = properties
+
+
+class FakeLocus:
+    """Stand-in for antares_client.models.Locus."""
+
+    def __init__(self, locus_id, ra, dec, properties, alerts, tags=None, catalogs=None, catalog_objects=None):
+        self.locus_id = locus_id
+        self.ra = ra
+        self.dec = dec
+        self.properties = properties
+        self.alerts = alerts
+        self.tags = tags or []
+        self.catalogs = catalogs or []
+        self.catalog_objects = catalog_objects or {}
+
+    @classmethod
+    def from_dict(cls, locus_dict):
+        """Build from the output of ANTARESBroker.alert_to_dict."""
+        return cls(
+            locus_id=locus_dict['locus_id'],
+            ra=locus_dict['ra'],
+            dec=locus_dict['dec'],
+            properties=locus_dict['properties'],
+            alerts=[FakeAlert(**alert) for alert in locus_dict['alerts']],
+            tags=locus_dict.get('tags'),
+            catalogs=locus_dict.get('catalogs'),
+        )
+
+
+def make_synthetic_loci(n_loci, n_alerts=10, seed=0):
+    """Generate n_loci fake loci, each with n_alerts alerts alternating
+    between ZTF g and R, with every fifth alert an upper limit.
+    """
+    rng = np.random.default_rng(seed)
+    ras = rng.uniform(0., 360., n_loci)
+    decs = np.degrees(np.arcsin(rng.uniform(-1., 1., n_loci)))
+    loci = []
+    for i in range(n_loci):
+        mjd0 = 59000. + rng.uniform(0., 1000.)
+        alerts = []
+        for j in range(n_alerts):
+            properties = {'ant_passband': 'g' if j % 2 else 'R', 'ztf_rb': 0.9}
+            if j % 5 == 4:
+                properties['ant_maglim'] = 20.5
+            else:
+                properties['ant_mag'] = 19. + rng.normal(0., 0.5)
+                properties['ant_magerr'] = 0.1
+            alerts.append(FakeAlert(f'ztf_candidate:{i}_{j}', mjd0 + 1.5 * j, properties))
+        mags = [alert.properties['ant_mag'] for alert in alerts if 'ant_mag' in alert.properties]
+        loci.append(FakeLocus(
+            locus_id=f'ANT{i:09d}',
+            ra=float(ras[i]),
+            dec=float(decs[i]),
+            properties={
+                'ztf_object_id': f'ZTF{i:09d}',
+                'num_mag_values': len(mags),
+                'newest_alert_observation_time': alerts[-1].mjd,
+                'oldest_alert_observation_time': alerts[0].mjd,
+                'newest_alert_magnitude': mags[-1] if mags else None,
+            },
+            alerts=alerts,
+        ))
+    return loci
+
+
+class FakeAntaresTransport:
+    """Offline transport replaying a fixed list of loci.
+
+    search() ignores the query and pages through every locus,
+    sleeping `latency` seconds before each page of `page_size`;
+    get_by_ztf_object_id() sleeps `latency` seconds per call.
+    """
+
+    def __init__(self, loci=(), latency=0., page_size=25):
+        self.loci = list(loci)
+        self.latency = latency
+        self.page_size = page_size
+        self.n_search_pages = 0
+        self.n_locus_requests = 0
+        self._by_ztf_id = {locus.properties['ztf_object_id']: locus for locus in self.loci}
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """Replay loci recorded as a JSON list of alert_to_dict outputs."""
+        with open(path) as f:
+            return cls([FakeLocus.from_dict(locus) for locus in json.load(f)], **kwargs)
+
+    @classmethod
+    def synthetic(cls, n_loci, n_alerts=10, seed=0, **kwargs):
+        return cls(make_synthetic_loci(n_loci, n_alerts=n_alerts, seed=seed), **kwargs)
+
+    def search(self, query):
+        for start in range(0, len(self.loci), self.page_size):
+            self.n_search_pages += 1
+            time.sleep(self.latency)
+            yield from self.loci[start:start + self.page_size]
+
+    def get_by_ztf_object_id(self, ztf_object_id):
+        self.n_locus_requests += 1
+        time.sleep(self.latency)
+        return self._by_ztf_id.get(ztf_object_id)
+
+
+def get_transport():
+    """Instantiate the transport named by settings.ANTARES_TRANSPORT."""
+    return import_string(getattr(settings, 'ANTARES_TRANSPORT', DEFAULT_TRANSPORT))()
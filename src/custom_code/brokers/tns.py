@@ -1,12 +1,13 @@
 import json
 from datetime import datetime, timedelta
 
-import requests
 from crispy_forms.layout import Div, Fieldset, HTML, Layout
 from django import forms
 from django.conf import settings
 from tom_alerts.alerts import GenericQueryForm, GenericAlert, GenericBroker
 
+from custom_code.http_client import get_http_client
+
 TNS_BASE_URL = 'https://www.wis-tns.org/'
 TNS_OBJECT_URL = f'{TNS_BASE_URL}api/get/object'
 TNS_SEARCH_URL = f'{TNS_BASE_URL}api/get/search'
@@ -120,7 +121,7 @@ class TNSBroker(GenericBroker):
                 'public_timestamp': public_timestamp,
             })
         }
-        response = requests.post(TNS_SEARCH_URL, data, headers=cls.tns_headers())
+        response = get_http_client().post(TNS_SEARCH_URL, data, headers=cls.tns_headers())
         response.raise_for_status()
         transients = response.json()
         alerts = []
@@ -133,7 +134,7 @@ class TNSBroker(GenericBroker):
                     'spectroscopy': 0,
                 })
             }
-            response = requests.post(TNS_OBJECT_URL, data, headers=cls.tns_headers())
+            response = get_http_client().post(TNS_OBJECT_URL, data, headers=cls.tns_headers())
             response.raise_for_status()
             alert = response.json()['data']['reply']
 
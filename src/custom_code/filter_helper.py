@@ -1,17 +1,23 @@
 import glob
+import logging
 import os
 import shutil
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 
-import antares_client
 import marshmallow
+import numpy as np
 from astro_ghost.ghostHelperFunctions import getTransientHosts
 from astropy import units as u
 from astropy.coordinates import SkyCoord
 from django.conf import settings
-from django.db import IntegrityError
+from django.db import IntegrityError, connections
+from django.db.models import Q
 from django.shortcuts import get_object_or_404
 from tom_targets.models import Target
 
+from custom_code.ghost import get_ghost_catalog
 from custom_code.models import TargetAux
 
 superphot_types = ['SN Ia', 'SN II', 'SN IIn', 'SLSN', 'SN Ibc']
@@ -21,6 +27,10 @@ STATIC_DIR = settings.STATICFILES_DIRS[0]
 GHOST_PATH = os.path.join(STATIC_DIR, "ghost")
 DATA_DIR = settings.MEDIA_ROOT
 TMP_ASSOCIATION_DIR = os.path.join(DATA_DIR, "ghost-temp/")
+MAX_ALERTS = 20
+ALERT_INGEST_WORKERS = getattr(settings, 'ALERT_INGEST_WORKERS', 4)
+
+logger = logging.getLogger(__name__)
 
 
 def get_sn_types():
@@ -42,123 +52,366 @@ def check_type_tns(locus, sn_type):
     return locus.catalog_objects['tns_public_objects'][0]['type'] == sn_type
 
 
-def save_alerts_to_group(project, broker):
-    """Save list of alerts' targets along
-    with a certain group tag."""
-    print(f"Querying alerts for {project.name}")
+class LocusCache:
+    """Per-run cache of loci and the targets made from them, keyed
+    by locus_id. Each locus is fetched and materialized at most once,
+    however many projects it matches. Safe to share between threads.
+    """
+
+    def __init__(self):
+        self._loci = {}
+        self._targets = {}
+        self._lock = threading.Lock()
+        self.locus_hits = 0
+        self.locus_misses = 0
+        self.target_hits = 0
+        self.saved_api_calls = 0
+
+    def get_locus(self, alert, fetch):
+        """Return the locus for alert, calling fetch() only on the first
+        request. Concurrent requests for the same locus wait for it.
+        """
+        with self._lock:
+            future = self._loci.get(alert['locus_id'])
+            owner = future is None
+            if owner:
+                future = Future()
+                self._loci[alert['locus_id']] = future
+                self.locus_misses += 1
+            else:
+                self.locus_hits += 1
+
+        if owner:
+            try:
+                future.set_result(fetch())
+            except Exception as e:
+                future.set_exception(e)
+        locus = future.result()
+
+        if not owner and locus is not None:
+            with self._lock:
+                self.saved_api_calls += 1
+        return locus
+
+    def get_target(self, alert):
+        with self._lock:
+            target = self._targets.get(alert['locus_id'])
+            if target is not None:
+                self.target_hits += 1
+            return target
+
+    def set_target(self, alert, target):
+        with self._lock:
+            self._targets[alert['locus_id']] = target
+
+    def stats(self):
+        return {
+            'locus_hits': self.locus_hits,
+            'locus_misses': self.locus_misses,
+            'target_hits': self.target_hits,
+            'saved_api_calls': self.saved_api_calls,
+        }
+
+
+def get_project_query(project):
+    """Collect everything needed to query the broker for a project,
+    so that fetching can run off the main thread.
+    """
+    return {
+        'name': project.name,
+        'query': project.queryset.generate_antares_query(),
+        'tns': project.tns,
+        'sn_types': [sn_type.sn_type for sn_type in project.sn_types.all()],
+        'tags': [tag_obj.antares_name for tag_obj in project.queryset.tags.all()],
+    }
+
+
+def locus_has_sn_type(locus, project_query):
+    """Whether locus has one of the project's supernova types.
+    Projects without selected types accept every locus.
+    """
+    if not project_query['sn_types']:
+        return True
+    # user selected some supernova types
+    # we will go through the locus and see if such types exist
+    for sn_type in project_query['sn_types']:
+        if (project_query['tns'] and check_type_tns(locus, tns_label_dict[sn_type])) \
+                or ('superphot_plus_class' in locus.properties
+                    and 'superphot_plus_classified' in project_query['tags']
+                    and locus.properties['superphot_plus_class'] == sn_type):
+            return True
+    return False
+
+
+def _run_in_worker(func, *args):
+    """Run func on a pool thread, closing that thread's
+    database connections afterwards.
+    """
+    try:
+        return func(*args)
+    finally:
+        connections.close_all()
 
-    MAX_ALERTS = 20
-    query = project.queryset.generate_antares_query()
-    print(query)
-    loci = antares_client.search.search(query)
-    tns = project.tns
-    sn_types = project.sn_types.all()
 
-    tag_objs = project.queryset.tags.all()
-    tags = [tag_obj.antares_name for tag_obj in tag_objs]
+def _fetch_locus(broker, alert, cache=None):
+    """Fetch the full locus behind alert, unless its target already exists."""
+    def fetch():
+        if Target.objects.filter(name=alert['properties']['ztf_object_id']).exists():
+            return None
+        return broker.fetch_alert(alert['properties']['ztf_object_id'])
 
-    n_alerts = 0
-    while n_alerts < MAX_ALERTS:
+    if cache is None:
+        return fetch()
+    return cache.get_locus(alert, fetch)
+
+
+def fetch_project_loci(project_query, broker, max_alerts=MAX_ALERTS, executor=None, cache=None):
+    """Broker I/O for one project: page through the search results
+    and fetch the full locus of each new match. Full loci are fetched
+    on executor and shared through cache, when given. Returns a list
+    of (alert, locus) pairs, where locus is None for targets already
+    in the database.
+    """
+    print(f"Querying alerts for {project_query['name']}")
+    print(project_query['query'])
+    loci = broker.transport.search(project_query['query'])
+
+    fetched = []
+    while len(fetched) < max_alerts:
         try:
             locus = next(loci)
         except (marshmallow.exceptions.ValidationError, StopIteration):
             print("no more loci")
             break
 
-        if sn_types:
-            # user selected some supernova types
-            # we will go through the locus and see if such types exist
-            # if not, we will skip this locus
-            ok = False
-            for sn_type in sn_types:
-                if (tns and check_type_tns(locus, tns_label_dict[sn_type.sn_type])) \
-                        or ('superphot_plus_class' in locus.properties
-                            and 'superphot_plus_classified' in tags
-                            and locus.properties['superphot_plus_class'] == sn_type.sn_type):
-                    ok = True
-                    break
-            if not ok:
-                # this locus does not have the supernova type(s) we want
-                # skip this locus
-                continue
+        if not locus_has_sn_type(locus, project_query):
+            # this locus does not have the supernova type(s) we want
+            continue
 
         alert = broker.alert_to_dict(locus)
-        try:
-            target, _, aliases = broker.to_target(alert)
-            target.save(names=aliases)
-            target_aux = TargetAux.create(
-                target=target, add_host=False
-            )
-            broker.process_reduced_data(target)
+        if executor is None:
+            fetched.append((alert, _fetch_locus(broker, alert, cache)))
+        else:
+            fetched.append((alert, executor.submit(_run_in_worker, _fetch_locus, broker, alert, cache)))
 
-        except IntegrityError:
+    return [
+        (alert, locus.result() if isinstance(locus, Future) else locus)
+        for alert, locus in fetched
+    ]
+
+
+def save_loci_to_group(project, broker, fetched, cache=None):
+    """Database side of the ingest: create targets and photometry
+    for fetched (alert, locus) pairs and add them to the project.
+    Targets already materialized in this run are reused from cache.
+    All targets join the project in one add, so its summary is
+    updated once per run; if that fails, they are added one by one.
+    """
+    targets = []
+    for alert, locus in fetched:
+        target = cache.get_target(alert) if cache is not None else None
+        if target is None and locus is not None:
+            try:
+                target, extras, aliases = broker.to_target(alert)
+                target.save(names=aliases, extras=extras)
+                target_aux = TargetAux.create(
+                    target=target, add_host=False
+                )
+                broker.process_reduced_data(target, alert=locus)
+            except IntegrityError:
+                target = None
+
+        if target is None:
             print('Target already in database.')
             target = get_object_or_404(
                 Target,
                 name=alert['properties']['ztf_object_id']
             )
+        if cache is not None:
+            cache.set_target(alert, target)
+        targets.append(target)
+    try:
+        project.targets.add(*targets)
+        return len(targets)
+    except IntegrityError:
+        logger.exception("Could not add %d targets to %s at once, adding them one by one.", len(targets), project)
+
+    n_added = 0
+    for target in targets:
         try:
             project.targets.add(target)
-            n_alerts += 1
-        except:
-            print('Error saving target to project')
+            n_added += 1
+        except IntegrityError:
+            logger.exception("Could not add target %s to %s.", target, project)
+    return n_added
 
 
-def update_all_hosts():
-    """Requeries all targets without hosts."""
+def save_alerts_to_group(project, broker, cache=None, max_alerts=MAX_ALERTS):
+    """Save list of alerts' targets along
+    with a certain group tag."""
+    fetched = fetch_project_loci(get_project_query(project), broker, max_alerts=max_alerts, cache=cache)
+    return save_loci_to_group(project, broker, fetched, cache=cache)
+
+
+def _timed_fetch(project_query, broker, executor, cache):
+    start = time.perf_counter()
+    fetched = fetch_project_loci(project_query, broker, executor=executor, cache=cache)
+    return fetched, time.perf_counter() - start
+
+
+def save_alerts_to_groups(projects, broker, workers=1, cache=None, on_project_done=None):
+    """Save alerts for many projects, overlapping broker I/O.
+
+    Up to `workers` project searches and `workers` locus fetches
+    run concurrently on thread pools, while all database writes
+    happen on the calling thread so SQLite sees a single writer.
+    Loci shared between projects are fetched and saved once per
+    cache, a fresh LocusCache by default.
+    on_project_done(name, result) is called as each project finishes.
+    Returns per-project alert counts and wall times.
+    """
+    workers = max(1, workers)
+    if cache is None:
+        cache = LocusCache()
+    project_queries = [(project, get_project_query(project)) for project in projects]
+    report = {}
+    with ThreadPoolExecutor(max_workers=workers) as search_pool, \
+            ThreadPoolExecutor(max_workers=workers) as locus_pool:
+        futures = {
+            search_pool.submit(_run_in_worker, _timed_fetch, project_query, broker, locus_pool, cache): project
+            for project, project_query in project_queries
+        }
+        for future in as_completed(futures):
+            project = futures[future]
+            try:
+                fetched, fetch_time = future.result()
+            except Exception as e:
+                print(f"Failed to query alerts for {project.name}: {e}")
+                report[project.name] = {'error': str(e)}
+                if on_project_done is not None:
+                    on_project_done(project.name, report[project.name])
+                continue
+
+            start = time.perf_counter()
+            n_alerts = save_loci_to_group(project, broker, fetched, cache=cache)
+            write_time = time.perf_counter() - start
+            report[project.name] = {
+                'alerts': n_alerts,
+                'fetch_time': fetch_time,
+                'write_time': write_time,
+            }
+            print(f"{project.name}: {n_alerts} alerts, fetch {fetch_time:.2f} s, write {write_time:.2f} s")
+            if on_project_done is not None:
+                on_project_done(project.name, report[project.name])
+
+    print("Locus cache: {locus_hits} hits, {locus_misses} misses, {target_hits} targets reused, "
+          "{saved_api_calls} API calls saved".format(**cache.stats()))
+    return report
+
+
+def _hostless_targets():
+    """Select all targets without a host in a single query,
+    creating any missing TargetAux rows in bulk.
+    """
+    targets = list(
+        Target.objects.select_related('aux_info').filter(
+            Q(aux_info__isnull=True) | Q(aux_info__host__isnull=True)
+        )
+    )
+    missing = [target for target in targets if not hasattr(target, 'aux_info')]
+    if missing:
+        auxs = TargetAux.objects.bulk_create([TargetAux(target=target) for target in missing])
+        for target, aux in zip(missing, auxs):
+            target.aux_info = aux
+    return targets
+
+
+def update_all_hosts(catalog=None, max_sep_arcsec=1.):
+    """Requeries all targets without hosts.
+
+    Hostless targets are first matched against the local GHOST
+    catalog, by name and then with one vectorized coordinate
+    cross-match. Only the unmatched remainder goes to the GHOST
+    host search. Returns per-stage counts and timings.
+    """
     print("Requerying all targets without hosts.")
-    names = []
-    coords = []
-    for i, target in enumerate(Target.objects.all()):
-        try:
-            # only requery those without hosts
-            if target.aux_info.host is None:
-                names.append(target.name)
-                print(target.name, target.ra, target.dec)
-
-                coords.append(
-                    SkyCoord(
-                        ra=target.ra * u.degree,
-                        dec=target.dec * u.degree,
-                        frame='icrs'
-                    )
-                )
-        except:
-            target_aux = TargetAux.create(
-                target=target,
-                add_host=False
-            )
-            names.append(target.name)
-            print(target.name, target.ra, target.dec)
-
-            coords.append(
-                SkyCoord(
-                    ra=target.ra * u.degree,
-                    dec=target.dec * u.degree,
-                    frame='icrs'
-                )
-            )
+    stats = {'timings': {}}
+    catalog = catalog or get_ghost_catalog()
+
+    start = time.perf_counter()
+    targets = _hostless_targets()
+    stats['hostless'] = len(targets)
+    stats['timings']['select'] = time.perf_counter() - start
 
-    print(names, coords)
-    hostDB = getTransientHosts(
-        transientName=names,
-        snCoord=coords,
-        snClass=[''] * len(coords),
-        savepath=TMP_ASSOCIATION_DIR,
-        GHOSTpath=GHOST_PATH,
-        redo_search=False,
-        verbose=1
+    start = time.perf_counter()
+    matched = {}
+    for i, target in enumerate(targets):
+        host_row = catalog.search_by_name(target.name)
+        if host_row is not None:
+            matched[i] = host_row
+    stats['name_matched'] = len(matched)
+    stats['timings']['name_match'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    remaining = [i for i in range(len(targets)) if i not in matched]
+    coords = SkyCoord(
+        ra=np.array([targets[i].ra for i in remaining], dtype=float) * u.degree,
+        dec=np.array([targets[i].dec for i in remaining], dtype=float) * u.degree,
+        frame='icrs'
     )
+    stats['timings']['coords'] = time.perf_counter() - start
 
-    # delete temp directory
-    association_dirs = glob.glob(os.path.join(TMP_ASSOCIATION_DIR, "*"))
-    for association_dir in association_dirs:
-        shutil.rmtree(association_dir)
+    start = time.perf_counter()
+    rows, _ = catalog.match_coordinates(coords, max_sep_arcsec=max_sep_arcsec)
+    for i, row in zip(remaining, rows):
+        if row >= 0:
+            matched[i] = catalog.row(row)
+    stats['coord_matched'] = len(matched) - stats['name_matched']
+    stats['timings']['coord_match'] = time.perf_counter() - start
 
-    for i in range(len(hostDB)):
-        try:
+    start = time.perf_counter()
+    for i, host_row in matched.items():
+        targets[i].aux_info._add_host_from_df_row(host_row)
+    stats['timings']['save_matched'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    unmatched = np.array([i for i in remaining if i not in matched], dtype=int)
+    stats['searched'] = len(unmatched)
+    stats['search_found'] = 0
+    if len(unmatched) > 0:
+        by_name = {targets[i].name: targets[i] for i in unmatched}
+        hostDB = getTransientHosts(
+            transientName=list(by_name),
+            snCoord=list(coords[np.searchsorted(remaining, unmatched)]),
+            snClass=[''] * len(unmatched),
+            savepath=TMP_ASSOCIATION_DIR,
+            GHOSTpath=GHOST_PATH,
+            redo_search=False,
+            verbose=1
+        )
+
+        # delete temp directory
+        association_dirs = glob.glob(os.path.join(TMP_ASSOCIATION_DIR, "*"))
+        for association_dir in association_dirs:
+            shutil.rmtree(association_dir)
+
+        for i in range(len(hostDB)):
             host_row = hostDB.iloc[i]
-            target = get_object_or_404(Target, name=host_row['TransientName'])
-            target.aux_info._add_host_from_df_row(host_row)
-        except:  # TO DO: handle transient name changing (add to target aliases)
-            continue
+            target = by_name.get(host_row['TransientName'])
+            if target is None:  # TO DO: handle transient name changing (add to target aliases)
+                continue
+            try:
+                target.aux_info._add_host_from_df_row(host_row)
+                stats['search_found'] += 1
+            except Exception as e:
+                print(f"Could not save host for {target.name}: {e}")
+    stats['timings']['ghost_search'] = time.perf_counter() - start
+
+    print(
+        f"Host association: {stats['hostless']} hostless, {stats['name_matched']} matched by name, "
+        f"{stats['coord_matched']} matched by position, {stats['search_found']}/{stats['searched']} "
+        f"found by GHOST search."
+    )
+    for stage, elapsed in stats['timings'].items():
+        print(f"  {stage}: {elapsed:.2f} s")
+    return stats
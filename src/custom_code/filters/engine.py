@@ -0,0 +1,148 @@
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.db import connections
+
+from custom_code.filters.filter_helper import FilterStats, get_filter_registry, write_target_extras
+from custom_code.lightcurves import photometry_rows, rows_to_lightcurves, split_by_target
+
+FILTER_BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+class FilterBatchError(Exception):
+    """Filters that failed on a batch, as {name: error}."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('; '.join(f'{name}: {error!r}' for name, error in errors.items()))
+
+
+def batch_lightcurves(targets):
+    """Photometry columns of each target in targets, read with one query.
+    Targets without photometry get empty columns.
+    """
+    by_target = split_by_target(rows_to_lightcurves(list(photometry_rows([t.id for t in targets]))))
+    empty = rows_to_lightcurves([])
+    return {target.id: by_target.get(target.id, empty) for target in targets}
+
+
+def _run_batch_in_worker(filter_name, targets, lightcurves):
+    """Entry point of pool workers; the registry sets filters up once per worker."""
+    return get_filter_registry().get(filter_name).run_batch(targets, lightcurves)
+
+
+def _split(targets, n_parts):
+    return [list(part) for part in np.array_split(np.arange(len(targets)), n_parts) if len(part)]
+
+
+class FilterEngine:
+    """Runs filters over many targets in batches.
+
+    Per batch, photometry is read with one query and each filter's
+    results are collected and written with write_target_extras.
+    Filters implementing run_batch get the whole batch at once and,
+    if cpu_bound, are spread over a process pool; other filters fall
+    back to run(target) per target.
+    """
+
+    def __init__(self, names=None, batch_size=FILTER_BATCH_SIZE, processes=0):
+        registry = get_filter_registry()
+        self.filters = [f for f in registry.filters if names is None or f.name in names]
+        missing = set(names or ()) - {f.name for f in self.filters}
+        if missing:
+            raise KeyError(f"No filters named {', '.join(sorted(missing))}")
+        self.batch_size = batch_size
+        self.processes = processes
+        self.stats = {f.name: FilterStats() for f in self.filters}
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            # forked workers must not reuse the parent's DB connections
+            connections.close_all()
+            self._pool = ProcessPoolExecutor(max_workers=self.processes)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _run_filter(self, f, targets, lightcurves):
+        if not f.has_run_batch:
+            results = {}
+            for target in targets:
+                extras = f.run(target)
+                if extras:
+                    results[target.id] = extras
+            return results
+        if f.cpu_bound and self.processes > 1 and len(targets) > 1:
+            pool = self._get_pool()
+            futures = [
+                pool.submit(
+                    _run_batch_in_worker, f.name,
+                    [targets[i] for i in part],
+                    {targets[i].id: lightcurves[targets[i].id] for i in part}
+                )
+                for part in _split(targets, self.processes)
+            ]
+            results = {}
+            for future in futures:
+                results.update(future.result() or {})
+            return results
+        return f.run_batch(targets, lightcurves) or {}
+
+    def run_batch(self, targets, raise_errors=False):
+        """Run all filters on one batch of targets and write their extras.
+        Returns the number of extras written. A failing filter is logged
+        and does not stop the others; with raise_errors, FilterBatchError
+        is raised once the other filters' extras are written.
+        """
+        lightcurves = batch_lightcurves(targets)
+        updates = {}
+        errors = {}
+        for f in self.filters:
+            start = time.perf_counter()
+            try:
+                for target_id, extras in self._run_filter(f, targets, lightcurves).items():
+                    updates.setdefault(target_id, {}).update(extras)
+            except Exception as e:
+                errors[f.name] = e
+                logger.exception("Filter %s failed on a batch of %d targets.", f.name, len(targets))
+            self.stats[f.name].add(time.perf_counter() - start, f.name in errors)
+        n_extras = write_target_extras(updates)
+        if errors and raise_errors:
+            raise FilterBatchError(errors)
+        return n_extras
+
+    def run(self, targets):
+        """Run the filters over a queryset of targets. Returns a report."""
+        start = time.perf_counter()
+        n_targets = 0
+        n_extras = 0
+        ids = list(targets.order_by('id').values_list('id', flat=True))
+        model = targets.model
+        try:
+            for i in range(0, len(ids), self.batch_size):
+                batch = list(model.objects.filter(id__in=ids[i:i + self.batch_size]).order_by('id'))
+                n_extras += self.run_batch(batch)
+                n_targets += len(batch)
+        finally:
+            self.close()
+        elapsed = time.perf_counter() - start
+        return {
+            'targets': n_targets,
+            'extras_written': n_extras,
+            'elapsed': elapsed,
+            'targets_per_second': n_targets / elapsed if elapsed else 0.,
+            'filters': {f.name: self.stats[f.name].as_dict() for f in self.filters},
+        }
+
+
+def run_filters(targets, names=None, batch_size=FILTER_BATCH_SIZE, processes=0):
+    """Run the named filters (default: all) over a queryset of targets."""
+    return FilterEngine(names, batch_size=batch_size, processes=processes).run(targets)
@@ -4,6 +4,9 @@ import abc
 class Filter(abc.ABC):
     """Abstract class for filter."""
 
+    # run run_batch in the engine's process pool, if it has one
+    cpu_bound = False
+
     @abc.abstractmethod
     def __init__(self):
         self.name = "base"
@@ -15,5 +18,20 @@ class Filter(abc.ABC):
 
     @abc.abstractmethod
     def run(self, target):
-        """Run for each individual light curve."""
+        """Run for each individual light curve.
+        May return a dict of extras to write on target.
+        """
         pass
+
+    def run_batch(self, targets, lightcurves):
+        """Optional vectorized run over many targets. lightcurves maps
+        each target ID to its photometry columns (see custom_code.lightcurves).
+        Returns a dict mapping target ID to a dict of extras to write.
+        With cpu_bound set, this runs in a worker process and must not
+        touch the database.
+        """
+        raise NotImplementedError
+
+    @property
+    def has_run_batch(self):
+        return type(self).run_batch is not Filter.run_batch
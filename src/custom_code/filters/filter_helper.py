@@ -1,12 +1,188 @@
-import glob
-import subprocess
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from dateutil.parser import parse
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+from tom_targets.models import TargetExtra
+
+logger = logging.getLogger(__name__)
+
+
+class FilterStats:
+    """Call count, errors and wall time of one filter."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.
+        self.max_time = 0.
+        self.setup_time = 0.
+
+    def add(self, elapsed, failed=False):
+        self.calls += 1
+        self.errors += failed
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'total_time': self.total_time,
+            'mean_time': self.total_time / self.calls if self.calls else 0.,
+            'max_time': self.max_time,
+            'setup_time': self.setup_time,
+        }
+
+
+def _set_extra_value(extra, value):
+    """Set value and its typed copies as TargetExtra.save() would."""
+    if value is None:
+        value = 'None'
+    try:
+        extra.float_value = float(value)
+    except (TypeError, ValueError, OverflowError):
+        extra.float_value = None
+    try:
+        extra.bool_value = bool(value)
+    except (TypeError, ValueError, OverflowError):
+        extra.bool_value = None
+    extra.time_value = None
+    if not extra.float_value:
+        try:
+            extra.time_value = value if isinstance(value, datetime) else parse(value)
+        except (TypeError, ValueError, OverflowError):
+            extra.time_value = None
+    extra.value = value
+
+
+def write_target_extras(updates, batch_size=500):
+    """Write {target_id: {key: value}} to TargetExtra with one read,
+    one bulk_update and one bulk_create, bypassing the post-save hook.
+    Returns the number of extras written.
+    """
+    updates = {tid: extras for tid, extras in updates.items() if extras}
+    if not updates:
+        return 0
+    keys = {key for extras in updates.values() for key in extras}
+    existing = {
+        (extra.target_id, extra.key): extra
+        for extra in TargetExtra.objects.filter(target_id__in=list(updates), key__in=keys)
+    }
+    to_update, to_create = [], []
+    for target_id, extras in updates.items():
+        for key, value in extras.items():
+            extra = existing.get((target_id, key))
+            if extra is None:
+                extra = TargetExtra(target_id=target_id, key=key)
+                to_create.append(extra)
+            else:
+                to_update.append(extra)
+            _set_extra_value(extra, value)
+    with transaction.atomic():
+        TargetExtra.objects.bulk_update(
+            to_update, ['value', 'float_value', 'bool_value', 'time_value'], batch_size=batch_size
+        )
+        TargetExtra.objects.bulk_create(to_create, batch_size=batch_size)
+    return len(to_update) + len(to_create)
+
+
+def discover_filter_classes():
+    """Filter subclasses named by dotted path in settings.TARGET_FILTERS.
+    Filters are opt-in: none run unless the setting lists them.
+    """
+    return [import_string(path) for path in getattr(settings, 'TARGET_FILTERS', [])]
+
+
+class FilterRegistry:
+    """Filters imported and instantiated once per process.
+
+    setup() of every filter runs on first use; a forked worker
+    re-runs it, since setup state may not survive the fork.
+    """
+
+    def __init__(self, classes=None):
+        self._classes = classes
+        self._filters = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.stats = {}
+
+    @property
+    def filters(self):
+        if self._filters is None or self._pid != os.getpid():
+            with self._lock:
+                if self._filters is None or self._pid != os.getpid():
+                    self._load()
+        return self._filters
+
+    def _load(self):
+        classes = self._classes if self._classes is not None else discover_filter_classes()
+        filters = []
+        for cls in classes:
+            f = cls()
+            stats = self.stats.setdefault(f.name, FilterStats())
+            start = time.perf_counter()
+            try:
+                f.setup()
+            except Exception:
+                logger.exception("Setup of filter %s failed, skipping it.", f.name)
+                continue
+            stats.setup_time = time.perf_counter() - start
+            filters.append(f)
+        self._filters = filters
+        self._pid = os.getpid()
+
+    def get(self, name):
+        for f in self.filters:
+            if f.name == name:
+                return f
+        raise KeyError(f"No filter named {name}")
+
+    def run(self, target, names=None):
+        """Run every filter (or those in names) on target in-process,
+        writing any extras they return. A failing filter is logged
+        and does not stop the others.
+        """
+        for f in self.filters:
+            if names is not None and f.name not in names:
+                continue
+            start = time.perf_counter()
+            failed = False
+            try:
+                extras = f.run(target)
+                if extras:
+                    write_target_extras({target.id: extras})
+            except Exception:
+                failed = True
+                logger.exception("Filter %s failed on target %s.", f.name, target)
+            elapsed = time.perf_counter() - start
+            self.stats[f.name].add(elapsed, failed)
+            logger.debug("Filter %s ran on %s in %.3f s.", f.name, target, elapsed)
+
+    def report(self):
+        return {name: stats.as_dict() for name, stats in self.stats.items()}
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_filter_registry():
+    """Return the process-wide FilterRegistry."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = FilterRegistry()
+    return _registry
 
 
 def get_all_filters():
-    """Get list of all filters"""
-    filters = []
-    filter_fn_list = glob.glob("./filters/*.py")
-    for filter_fn in filter_fn_list:
-        filter_obj = subprocess.run(["python", filter_fn])
-        filters.append(filter_obj)
-    return filters
+    """Get list of all filters, set up and ready to run."""
+    return get_filter_registry().filters
@@ -1,4 +1,4 @@
-from ..filter_base import Filter
+from custom_code.filters.filter_base import Filter
 
 
 class TestFilter(Filter):
@@ -13,4 +13,8 @@ class TestFilter(Filter):
 
     def run(self, target):
         """Run for each individual light curve."""
-        target.save(extras={'test_field': 0})
+        return {'test_field': 0}
+
+    def run_batch(self, targets, lightcurves):
+        """Run for many light curves at once."""
+        return {target.id: {'test_field': 0} for target in targets}
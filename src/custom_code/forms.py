@@ -1,8 +1,8 @@
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Div, Layout, Submit, Fieldset, HTML
 from django import forms
-from tom_antares.antares import get_tag_choices
 
+from custom_code.brokers.antares_tags import get_tag_choices
 from custom_code.filter_helper import (
     get_sn_types
 )
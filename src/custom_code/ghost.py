@@ -0,0 +1,325 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+from astropy import units as u
+from astropy.coordinates import SkyCoord, match_coordinates_sky
+from django.conf import settings
+from scipy.spatial import cKDTree
+
+STATIC_DIR = settings.STATICFILES_DIRS[0]
+GHOST_CSV = os.path.join(STATIC_DIR, "ghost/database/GHOST.csv")
+MANIFEST_NAME = "manifest.json"
+
+logger = logging.getLogger(__name__)
+
+_catalogs = {}
+_catalog_lock = threading.Lock()
+
+
+def radec_to_unit_vectors(ra, dec):
+    """Convert RA/Dec (degrees) to an (N, 3) array of
+    unit vectors on the celestial sphere.
+    """
+    ra = np.radians(np.atleast_1d(np.asarray(ra, dtype=float)))
+    dec = np.radians(np.atleast_1d(np.asarray(dec, dtype=float)))
+    cos_dec = np.cos(dec)
+    return np.column_stack((cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)))
+
+
+def arcsec_to_chord(sep_arcsec):
+    """Chord length between two unit vectors separated
+    by sep_arcsec on the sky.
+    """
+    return 2. * np.sin(np.radians(np.asarray(sep_arcsec, dtype=float) / 3600.) / 2.)
+
+
+def chord_to_arcsec(chord):
+    """Inverse of arcsec_to_chord."""
+    chord = np.clip(np.asarray(chord, dtype=float), 0., 2.)
+    return np.degrees(2. * np.arcsin(chord / 2.)) * 3600.
+
+
+class GhostCatalog:
+    """In-memory GHOST catalog with per-column hash indices
+    and a k-d tree over transient unit vectors.
+
+    Columns are stored as a dict of NumPy arrays, memory-mapped
+    when loaded from the columnar cache. Indices are built lazily
+    on first use.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self._indices = {}
+        self._tree = None
+        self._tree_rows = None
+        self._transient_coords = None
+        self._coord_rows = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_csv(cls, path=GHOST_CSV):
+        df = pd.read_csv(path)
+        return cls({col: df[col].to_numpy() for col in df.columns})
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+        return len(next(iter(self.columns.values())))
+
+    @classmethod
+    def from_cache(cls, cache_dir):
+        """Memory-map a columnar cache written by build_column_cache."""
+        with open(os.path.join(cache_dir, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        return cls({
+            col: np.load(os.path.join(cache_dir, fn), mmap_mode='r', allow_pickle=False)
+            for col, fn in manifest['columns'].items()
+        })
+
+    def index(self, column):
+        """Dict mapping each non-empty string value of column
+        to the array of rows holding it. Built once per column.
+        """
+        if column not in self._indices:
+            with self._lock:
+                if column not in self._indices:
+                    index = {}
+                    for i, value in enumerate(self.columns[column].tolist()):
+                        if isinstance(value, str) and value:
+                            index.setdefault(value, []).append(i)
+                    self._indices[column] = {k: np.asarray(v) for k, v in index.items()}
+        return self._indices[column]
+
+    def _transient_positions(self):
+        """Rows with finite TransientRA/TransientDEC and their positions."""
+        ra = np.asarray(self.columns['TransientRA'], dtype=float)
+        dec = np.asarray(self.columns['TransientDEC'], dtype=float)
+        rows = np.flatnonzero(np.isfinite(ra) & np.isfinite(dec))
+        return rows, ra[rows], dec[rows]
+
+    @property
+    def tree(self):
+        """k-d tree over the unit vectors of TransientRA/TransientDEC.
+        Working on the unit sphere avoids the RA wrap-around at 0/360.
+        """
+        if self._tree is None:
+            with self._lock:
+                if self._tree is None:
+                    rows, ra, dec = self._transient_positions()
+                    self._tree_rows = rows
+                    self._tree = cKDTree(radec_to_unit_vectors(ra, dec))
+        return self._tree
+
+    def row(self, idx):
+        """Return catalog row idx as a pandas Series."""
+        return pd.Series({col: _missing_to_nan(values[idx]) for col, values in self.columns.items()})
+
+    def select(self, rows, columns=None):
+        """Return rows as a DataFrame, reading only the requested columns.
+        A single column name returns a Series, as DataFrame indexing would.
+        """
+        if isinstance(columns, str):
+            return self.select(rows, [columns])[columns]
+        if columns is None:
+            columns = list(self.columns)
+        rows = np.asarray(rows, dtype=int)
+        df = pd.DataFrame({col: np.asarray(self.columns[col][rows]) for col in columns})
+        return df.replace('', np.nan)
+
+    def search_by_name(self, transient_name):
+        """Return the row matching any naming variant of
+        transient_name, or None.
+        """
+        name = re.sub(r"\s+", "", str(transient_name))
+        for possible_name in [name, name.upper(), name.lower(), "SN" + name]:
+            rows = self.index('TransientName').get(possible_name)
+            if rows is not None:
+                return self.row(rows[0])
+        return None
+
+    def cone_search(self, ra, dec, radius_arcsec):
+        """Return (row indices, separations in arcsec) of all transients
+        within radius_arcsec of (ra, dec), sorted by separation.
+        """
+        vec = radec_to_unit_vectors(ra, dec)[0]
+        hits = self.tree.query_ball_point(vec, float(arcsec_to_chord(radius_arcsec)))
+        if not hits:
+            return np.array([], dtype=int), np.array([], dtype=float)
+        hits = np.asarray(hits, dtype=int)
+        chords = np.linalg.norm(self.tree.data[hits] - vec, axis=1)
+        order = np.argsort(chords)
+        return self._tree_rows[hits[order]], chord_to_arcsec(chords[order])
+
+    @property
+    def transient_coords(self):
+        """SkyCoord of all transients with finite positions."""
+        if self._transient_coords is None:
+            with self._lock:
+                if self._transient_coords is None:
+                    rows, ra, dec = self._transient_positions()
+                    self._coord_rows = rows
+                    self._transient_coords = SkyCoord(ra=ra * u.deg, dec=dec * u.deg, frame='icrs')
+        return self._transient_coords
+
+    def match_coordinates(self, coords, max_sep_arcsec=1.):
+        """Vectorized nearest-transient match of a SkyCoord array.
+        Returns (row indices, separations in arcsec); unmatched
+        entries have row index -1.
+        """
+        if len(coords) == 0 or len(self.transient_coords) == 0:
+            return np.full(len(coords), -1, dtype=int), np.full(len(coords), np.nan)
+        idx, sep, _ = match_coordinates_sky(coords, self.transient_coords)
+        sep = sep.arcsec
+        rows = np.where(sep <= max_sep_arcsec, self._coord_rows[idx], -1)
+        return rows, sep
+
+    def nearest(self, ra, dec, max_sep_arcsec=1.):
+        """Return the row of the closest transient within
+        max_sep_arcsec of (ra, dec), or None.
+        """
+        chord, idx = self.tree.query(
+            radec_to_unit_vectors(ra, dec)[0],
+            distance_upper_bound=float(arcsec_to_chord(max_sep_arcsec))
+        )
+        if not np.isfinite(chord):
+            return None
+        return self.row(self._tree_rows[idx])
+
+
+def _missing_to_nan(value):
+    """Empty strings mark missing values in the columnar cache.
+    NumPy scalars are returned as the equivalent Python objects.
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, str) and not value:
+        return np.nan
+    return value
+
+
+def _to_storable(values):
+    """Convert a DataFrame column to a dtype np.load can memory-map.
+    Object columns become fixed-width unicode with '' for missing.
+    """
+    if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+        return values.to_numpy()
+    return np.asarray(values.fillna('').astype(str).to_numpy(), dtype=str)
+
+
+def column_cache_dir(csv_path=GHOST_CSV):
+    """Directory holding the columnar cache of csv_path, next to the CSV."""
+    root, _ = os.path.splitext(csv_path)
+    return root + "_columns"
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_is_stale(csv_path=GHOST_CSV, cache_dir=None, rehash=True):
+    """Check the cache against csv_path. A matching mtime and size is
+    trusted as is; otherwise the CSV is hashed, so touching the file
+    without changing it does not force a rebuild. With rehash=False
+    any mismatch counts as stale and the CSV is never read.
+    """
+    cache_dir = cache_dir or column_cache_dir(csv_path)
+    manifest_fn = os.path.join(cache_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_fn):
+        return True
+    with open(manifest_fn) as f:
+        manifest = json.load(f)
+
+    stat = os.stat(csv_path)
+    if stat.st_mtime == manifest['csv_mtime'] and stat.st_size == manifest['csv_size']:
+        return False
+    if not rehash or file_sha256(csv_path) != manifest['csv_sha256']:
+        return True
+
+    manifest['csv_mtime'] = stat.st_mtime
+    manifest['csv_size'] = stat.st_size
+    with open(manifest_fn, 'w') as f:
+        json.dump(manifest, f)
+    return False
+
+
+def build_column_cache(csv_path=GHOST_CSV, cache_dir=None):
+    """Parse csv_path once and write one .npy file per column plus
+    a manifest. The new cache replaces the old one only once complete.
+    """
+    cache_dir = cache_dir or column_cache_dir(csv_path)
+    tmp_dir = cache_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    stat = os.stat(csv_path)
+    df = pd.read_csv(csv_path)
+    columns = {}
+    for i, col in enumerate(df.columns):
+        fn = f"col_{i:03d}.npy"
+        np.save(os.path.join(tmp_dir, fn), _to_storable(df[col]), allow_pickle=False)
+        columns[col] = fn
+
+    manifest = {
+        'csv_path': os.path.abspath(csv_path),
+        'csv_mtime': stat.st_mtime,
+        'csv_size': stat.st_size,
+        'csv_sha256': file_sha256(csv_path),
+        'n_rows': len(df),
+        'columns': columns,
+    }
+    with open(os.path.join(tmp_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f)
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+    return manifest
+
+
+def load_catalog(csv_path=GHOST_CSV):
+    """Memory-map the columnar cache of csv_path, rebuilding it
+    first if it is missing or stale.
+    """
+    cache_dir = column_cache_dir(csv_path)
+    if cache_is_stale(csv_path, cache_dir):
+        logger.warning("Column cache for %s is missing or stale, rebuilding.", csv_path)
+        build_column_cache(csv_path, cache_dir)
+    return GhostCatalog.from_cache(cache_dir)
+
+
+def get_ghost_catalog(csv_path=GHOST_CSV):
+    """Return the process-wide catalog for csv_path, loading it on first call."""
+    csv_path = os.path.abspath(csv_path)
+    if csv_path not in _catalogs:
+        with _catalog_lock:
+            if csv_path not in _catalogs:
+                _catalogs[csv_path] = load_catalog(csv_path)
+    return _catalogs[csv_path]
+
+
+def preload_ghost_catalog():
+    """Map an up-to-date GHOST cache before the web server forks, so
+    workers share its pages. Run from wsgi.py when GHOST_PRELOAD is
+    set; everywhere else the catalog loads on first use. Never parses
+    or hashes the CSV: a cache whose manifest does not match the CSV's
+    size and mtime is skipped.
+    """
+    csv_path = os.path.abspath(GHOST_CSV)
+    cache_dir = column_cache_dir(csv_path)
+    if not os.path.exists(csv_path) or cache_is_stale(csv_path, cache_dir, rehash=False):
+        return None
+    with _catalog_lock:
+        if csv_path not in _catalogs:
+            _catalogs[csv_path] = GhostCatalog.from_cache(cache_dir)
+    return _catalogs[csv_path]
@@ -0,0 +1,99 @@
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from tom_targets.models import Target
+
+from custom_code.models import TargetHookTask
+
+DEFER_TARGET_POST_SAVE = getattr(settings, 'DEFER_TARGET_POST_SAVE', True)
+HOOK_QUEUE_BATCH_SIZE = 200
+HOOK_QUEUE_CLAIM_TIMEOUT = 600
+HOOK_QUEUE_MAX_ATTEMPTS = 5
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_targets(target_ids):
+    """Queue post-save work for target_ids. A target that is already
+    queued keeps a single task, with its enqueue time refreshed and
+    its failed attempts reset.
+    """
+    now = timezone.now()
+    TargetHookTask.objects.bulk_create(
+        [TargetHookTask(target_id=target_id, enqueued=now) for target_id in set(target_ids)],
+        update_conflicts=True,
+        unique_fields=['target'],
+        update_fields=['enqueued', 'attempts'],
+    )
+
+
+def _claimable(timeout):
+    stale = timezone.now() - timedelta(seconds=timeout)
+    return Q(claimed_at__isnull=True) | Q(claimed_at__lt=stale)
+
+
+def claim_tasks(batch_size=HOOK_QUEUE_BATCH_SIZE, timeout=HOOK_QUEUE_CLAIM_TIMEOUT,
+                max_attempts=HOOK_QUEUE_MAX_ATTEMPTS):
+    """Claim up to batch_size of the oldest pending tasks. Claims older
+    than timeout seconds are considered abandoned and taken over.
+    Returns (token, claimed tasks).
+    """
+    token = uuid.uuid4().hex
+    ids = list(
+        TargetHookTask.objects.filter(_claimable(timeout), attempts__lt=max_attempts)
+        .order_by('enqueued').values_list('id', flat=True)[:batch_size]
+    )
+    if not ids:
+        return token, []
+    # the claimable filter is repeated so concurrent workers cannot both win a task
+    TargetHookTask.objects.filter(_claimable(timeout), id__in=ids).update(
+        claimed_at=timezone.now(), claimed_by=token
+    )
+    return token, list(TargetHookTask.objects.filter(claimed_by=token))
+
+
+def complete_tasks(token):
+    """Delete the tasks held by token. Targets re-enqueued while their
+    task was running are released to run again instead.
+    """
+    TargetHookTask.objects.filter(claimed_by=token, enqueued__lte=F('claimed_at')).delete()
+    TargetHookTask.objects.filter(claimed_by=token).update(claimed_at=None, claimed_by='')
+
+
+def fail_tasks(token, error):
+    TargetHookTask.objects.filter(claimed_by=token).update(
+        claimed_at=None, claimed_by='', attempts=F('attempts') + 1, last_error=str(error)
+    )
+
+
+def process_batch(engine, batch_size=HOOK_QUEUE_BATCH_SIZE, timeout=HOOK_QUEUE_CLAIM_TIMEOUT,
+                  max_attempts=HOOK_QUEUE_MAX_ATTEMPTS):
+    """Claim one batch of tasks and run engine's filters on their targets.
+    If any filter fails, the tasks stay queued with one more attempt.
+    Returns the number of targets processed.
+    """
+    token, tasks = claim_tasks(batch_size, timeout, max_attempts)
+    if not tasks:
+        return 0
+    targets = list(Target.objects.filter(id__in=[task.target_id for task in tasks]).order_by('id'))
+    try:
+        engine.run_batch(targets, raise_errors=True)
+    except Exception as e:
+        logger.exception("Post-save batch of %d targets failed.", len(targets))
+        fail_tasks(token, e)
+        return 0
+    complete_tasks(token)
+    return len(targets)
+
+
+def pending_count(max_attempts=HOOK_QUEUE_MAX_ATTEMPTS):
+    return TargetHookTask.objects.filter(attempts__lt=max_attempts).count()
+
+
+def claimable_count(timeout=HOOK_QUEUE_CLAIM_TIMEOUT, max_attempts=HOOK_QUEUE_MAX_ATTEMPTS):
+    """Pending tasks that no live worker holds, so a batch could claim them."""
+    return TargetHookTask.objects.filter(_claimable(timeout), attempts__lt=max_attempts).count()
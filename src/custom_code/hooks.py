@@ -1,8 +1,26 @@
-from custom_code.filters.filter_helper import get_all_filters
+import threading
+
+from custom_code.filters.filter_helper import get_filter_registry
+from custom_code.hook_queue import DEFER_TARGET_POST_SAVE, enqueue_targets
+
+_running = threading.local()
 
 
 def target_post_save(target, created):
-    """Custom post-save workflow for target."""
-    for f in get_all_filters():
-        print(f.name)
-        f.run(target)
+    """Custom post-save workflow for target.
+
+    With DEFER_TARGET_POST_SAVE (the default) the target is only queued,
+    and process_hook_queue runs the filters later in batches. Otherwise
+    filters run in-process; saves made by the filters themselves re-enter
+    this hook and are ignored, so filters cannot recurse.
+    """
+    if DEFER_TARGET_POST_SAVE:
+        enqueue_targets([target.id])
+        return
+    if getattr(_running, 'active', False):
+        return
+    _running.active = True
+    try:
+        get_filter_registry().run(target)
+    finally:
+        _running.active = False
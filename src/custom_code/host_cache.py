@@ -0,0 +1,209 @@
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache as django_cache
+
+HOST_CACHE_DIR = getattr(settings, 'HOST_CACHE_DIR', os.path.join(settings.MEDIA_ROOT, 'host_cache'))
+HOST_CACHE_MAX_BYTES = getattr(settings, 'HOST_CACHE_MAX_BYTES', 512 * 2**20)
+DEFAULT_FILTERS = "grizy"
+# threads per process warming the cache on page misses
+HOST_PREFETCH_WORKERS = getattr(settings, 'HOST_PREFETCH_WORKERS', 2)
+# seconds before a host whose prefetch failed is tried again
+HOST_PREFETCH_RETRY_AFTER = getattr(settings, 'HOST_PREFETCH_RETRY_AFTER', 600)
+
+logger = logging.getLogger(__name__)
+
+
+class HostMediaCache:
+    """On-disk cache of host galaxy cutout images and NED spectra.
+
+    Images are stored as the PNG bytes returned by PS1, keyed by host ID
+    and filter set; spectra are stored as one .npz per host. An empty
+    .npz records that NED has no spectra for the host. File mtimes are
+    bumped on every hit, so evict() drops the least recently used files.
+    """
+
+    def __init__(self, root=HOST_CACHE_DIR, max_bytes=HOST_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._evict_lock = threading.Lock()
+
+    def image_path(self, host_id, filters=DEFAULT_FILTERS):
+        return os.path.join(self.root, 'images', f"{host_id}_{filters}.png")
+
+    def spectra_path(self, host_id):
+        return os.path.join(self.root, 'spectra', f"{host_id}.npz")
+
+    def _read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path, write):
+        """Write through a temporary file so readers never see partial files."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def has_image(self, host_id, filters=DEFAULT_FILTERS):
+        return os.path.exists(self.image_path(host_id, filters))
+
+    def has_spectra(self, host_id):
+        return os.path.exists(self.spectra_path(host_id))
+
+    def get_image(self, host_id, filters=DEFAULT_FILTERS):
+        """PNG bytes of the cached image, or None on a miss."""
+        return self._read(self.image_path(host_id, filters))
+
+    def put_image(self, host_id, png_bytes, filters=DEFAULT_FILTERS):
+        self._write(self.image_path(host_id, filters), lambda f: f.write(png_bytes))
+
+    def get_spectra(self, host_id):
+        """Cached spectra as a list of (wv, flux, flux_err) arrays,
+        [] if the host is known to have none, or None on a miss.
+        """
+        path = self.spectra_path(host_id)
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                spectra = [
+                    (npz[f"wv_{i}"], npz[f"flux_{i}"], npz[f"flux_err_{i}"])
+                    for i in range(len(npz.files) // 3)
+                ]
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return spectra
+
+    def put_spectra(self, host_id, spectra):
+        """Store spectra decoded once from NED. Fluxes are kept in
+        single precision; wavelengths keep full precision.
+        """
+        arrays = {}
+        for i, (wv, flux, flux_err) in enumerate(spectra):
+            arrays[f"wv_{i}"] = np.asarray(wv, dtype=np.float64)
+            arrays[f"flux_{i}"] = np.asarray(flux, dtype=np.float32)
+            arrays[f"flux_err_{i}"] = np.asarray(flux_err, dtype=np.float32)
+        self._write(self.spectra_path(host_id), lambda f: np.savez(f, **arrays))
+
+    def fetch(self, host, filters=DEFAULT_FILTERS, force=False):
+        """Download whatever is missing for host into the cache.
+        Network errors propagate and nothing is cached for them.
+        """
+        if force or not self.has_image(host.ID, filters):
+            self.put_image(host.ID, host.fetch_image(filters), filters)
+        if force or not self.has_spectra(host.ID):
+            self.put_spectra(host.ID, host.fetch_spectra())
+
+    def etag(self, host_id, filters=DEFAULT_FILTERS):
+        """Validator for the cached media of host_id, or None if anything
+        is missing. Built from inode and size, which change when a file
+        is rewritten but not when a hit bumps its mtime.
+        """
+        parts = [str(host_id), filters]
+        for path in (self.image_path(host_id, filters), self.spectra_path(host_id)):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return None
+            parts.append(f"{stat.st_ino:x}-{stat.st_size:x}")
+        return '"' + ':'.join(parts) + '"'
+
+    def size(self):
+        return sum(os.path.getsize(path) for path, _ in self._files())
+
+    def _files(self):
+        """(path, stat result) of every cached file."""
+        files = []
+        for subdir in ('images', 'spectra'):
+            try:
+                entries = os.scandir(os.path.join(self.root, subdir))
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_file() and not entry.name.endswith('.tmp'):
+                        files.append((entry.path, entry.stat()))
+        return files
+
+    def evict(self):
+        """Delete least recently used files until the cache fits in max_bytes.
+        Returns the number of files deleted.
+        """
+        with self._evict_lock:
+            files = sorted(self._files(), key=lambda f: f[1].st_mtime)
+            total = sum(stat.st_size for _, stat in files)
+            n_deleted = 0
+            for path, stat in files:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= stat.st_size
+                n_deleted += 1
+            return n_deleted
+
+
+_cache = None
+_executor = None
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def get_host_cache():
+    """Return the process-wide HostMediaCache."""
+    global _cache
+    if _cache is None:
+        _cache = HostMediaCache()
+    return _cache
+
+
+def _failed_key(host_id):
+    return f'host_prefetch_failed:{host_id}'
+
+
+def _prefetch(host, filters):
+    try:
+        cache = get_host_cache()
+        cache.fetch(host, filters)
+        cache.evict()
+    except Exception as e:
+        logger.warning("Could not prefetch media for host %s: %s", host.name, e)
+        django_cache.set(_failed_key(host.ID), True, HOST_PREFETCH_RETRY_AFTER)
+    finally:
+        with _pending_lock:
+            _pending.discard(host.ID)
+
+
+def prefetch_in_background(host, filters=DEFAULT_FILTERS):
+    """Warm the cache for host on the shared prefetch threads, so the
+    page render itself never waits. Hosts already being fetched, or
+    whose fetch failed in the last HOST_PREFETCH_RETRY_AFTER seconds,
+    are skipped. Returns the future of the fetch, or None if skipped.
+    """
+    global _executor
+    if django_cache.get(_failed_key(host.ID)):
+        return None
+    with _pending_lock:
+        if host.ID in _pending:
+            return None
+        _pending.add(host.ID)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=HOST_PREFETCH_WORKERS, thread_name_prefix='host-prefetch')
+    return _executor.submit(_prefetch, host, filters)
@@ -0,0 +1,214 @@
+import bisect
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+HTTP_TIMEOUT = getattr(settings, 'HTTP_TIMEOUT', (5., 30.))
+HTTP_RETRIES = getattr(settings, 'HTTP_RETRIES', 3)
+HTTP_BACKOFF = getattr(settings, 'HTTP_BACKOFF', 0.5)
+HTTP_POOL_SIZE = getattr(settings, 'HTTP_POOL_SIZE', 10)
+# minimum seconds between requests to a host
+HTTP_MIN_INTERVAL = getattr(settings, 'HTTP_MIN_INTERVAL', {'www.wis-tns.org': 1.})
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30.)
+
+logger = logging.getLogger(__name__)
+
+
+class HostMetrics:
+    """Request counters and latency histogram of one host."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttled_time = 0.
+        self.bytes_received = 0
+        self.total_time = 0.
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def as_dict(self):
+        buckets = [f"<={b}s" for b in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}s"]
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'throttled_time': self.throttled_time,
+            'bytes_received': self.bytes_received,
+            'mean_latency': self.total_time / self.requests if self.requests else 0.,
+            'latency_histogram': dict(zip(buckets, self.latency_counts)),
+        }
+
+
+class HttpMetrics:
+    """Thread-safe per-host request metrics."""
+
+    def __init__(self):
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, host):
+        if host not in self._hosts:
+            self._hosts[host] = HostMetrics()
+        return self._hosts[host]
+
+    def record(self, host, elapsed, n_bytes=0, failed=False):
+        with self._lock:
+            metrics = self._host(host)
+            metrics.requests += 1
+            metrics.errors += failed
+            metrics.bytes_received += n_bytes
+            metrics.total_time += elapsed
+            metrics.latency_counts[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+
+    def record_retry(self, host):
+        with self._lock:
+            self._host(host).retries += 1
+
+    def record_throttle(self, host, waited):
+        with self._lock:
+            self._host(host).throttled_time += waited
+
+    def snapshot(self):
+        with self._lock:
+            return {host: metrics.as_dict() for host, metrics in self._hosts.items()}
+
+    def summary(self):
+        """One line per host, for command output."""
+        return [
+            f"{host}: {m['requests']} requests, {m['retries']} retries, {m['errors']} errors, "
+            f"{m['bytes_received'] / 2**20:.1f} MiB, mean {m['mean_latency']:.3f} s, "
+            f"throttled {m['throttled_time']:.1f} s"
+            for host, m in self.snapshot().items()
+        ]
+
+
+class RateLimiter:
+    """Per-host pacing. Enforces HTTP_MIN_INTERVAL between requests and
+    holds requests back until a host's announced rate-limit reset.
+    """
+
+    def __init__(self, min_interval=None):
+        self.min_interval = HTTP_MIN_INTERVAL if min_interval is None else min_interval
+        self._next_allowed = {}
+        self._lock = threading.Lock()
+
+    def wait(self, host):
+        """Block until a request to host is allowed; returns seconds waited."""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_allowed.get(host, now))
+            self._next_allowed[host] = start + self.min_interval.get(host, 0.)
+        delay = start - now
+        if delay > 0:
+            time.sleep(delay)
+        return max(delay, 0.)
+
+    def hold(self, host, seconds):
+        """Allow no further requests to host for seconds."""
+        with self._lock:
+            until = time.monotonic() + seconds
+            self._next_allowed[host] = max(self._next_allowed.get(host, until), until)
+
+
+def _retry_after(response):
+    """Seconds a response asks us to wait, from Retry-After or
+    the rate-limit reset headers TNS sends, else None.
+    """
+    value = response.headers.get('Retry-After')
+    if value:
+        try:
+            return max(float(value), 0.)
+        except ValueError:
+            try:
+                return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.)
+            except (TypeError, ValueError):
+                pass
+    if response.headers.get('x-rate-limit-remaining') == '0':
+        try:
+            return max(float(response.headers.get('x-rate-limit-reset', 0)), 0.)
+        except ValueError:
+            pass
+    return None
+
+
+class HttpClient:
+    """Shared requests.Session with per-host keep-alive connection
+    pools, default timeouts, retries with jittered exponential backoff,
+    rate limiting and metrics.
+    """
+
+    def __init__(self, timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES, backoff=HTTP_BACKOFF,
+                 pool_size=HTTP_POOL_SIZE, rate_limiter=None):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.metrics = HttpMetrics()
+
+    def request(self, method, url, retries=None, **kwargs):
+        """Send a request, retrying connection errors and 429/5xx responses.
+        The last response is returned as is; callers raise_for_status().
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        retries = self.retries if retries is None else retries
+        host = urlsplit(url).netloc
+        for attempt in range(retries + 1):
+            self.metrics.record_throttle(host, self.rate_limiter.wait(host))
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.metrics.record(host, time.perf_counter() - start, failed=True)
+                if attempt == retries:
+                    raise
+                delay = None
+                logger.info("%s %s failed (%s), retrying.", method, url, e)
+            else:
+                n_bytes = (
+                    int(response.headers.get('Content-Length', 0)) if kwargs.get('stream')
+                    else len(response.content)
+                )
+                self.metrics.record(
+                    host, time.perf_counter() - start, n_bytes, failed=response.status_code >= 400
+                )
+                delay = _retry_after(response)
+                if delay is not None:
+                    self.rate_limiter.hold(host, delay)
+                if response.status_code not in RETRY_STATUSES or attempt == retries:
+                    return response
+                logger.info("%s %s returned %d, retrying.", method, url, response.status_code)
+            self.metrics.record_retry(host)
+            if delay is None:
+                time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """Return the process-wide HttpClient."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HttpClient()
+    return _client
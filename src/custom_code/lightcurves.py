@@ -0,0 +1,215 @@
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from tom_dataproducts.models import ReducedDatum
+from tom_targets.models import Target
+
+from custom_code.models import PackedLightcurve
+
+LIGHTCURVE_COLUMNS = ('target_id', 'mjd', 'filter', 'mag', 'magerr', 'is_limit')
+LIGHTCURVE_CHUNK_SIZE = 100000
+UNIX_EPOCH_MJD = 40587.
+
+PACKED_LIGHTCURVES = getattr(settings, 'PACKED_LIGHTCURVES', True)
+# 19 bytes per point; filter is an index into the PackedLightcurve's filters
+PACKED_DTYPE = np.dtype([
+    ('mjd', '<f8'),
+    ('mag', '<f4'),
+    ('magerr', '<f4'),
+    ('filter', '<u2'),
+    ('is_limit', '?'),
+])
+
+
+def rows_to_lightcurves(rows):
+    """Convert (target_id, timestamp, value) photometry rows into a dict
+    of column arrays. Upper limits have the limit as mag, NaN magerr
+    and is_limit set.
+    """
+    n = len(rows)
+    target_id = np.empty(n, dtype=np.int64)
+    seconds = np.empty(n, dtype=float)
+    mag = np.empty(n, dtype=float)
+    magerr = np.empty(n, dtype=float)
+    is_limit = np.empty(n, dtype=bool)
+    filters = []
+    for i, (tid, timestamp, value) in enumerate(rows):
+        target_id[i] = tid
+        seconds[i] = timestamp.timestamp()
+        if 'magnitude' in value:
+            mag[i] = value['magnitude']
+            magerr[i] = value.get('error', np.nan)
+            is_limit[i] = False
+        else:
+            mag[i] = value.get('limit', np.nan)
+            magerr[i] = np.nan
+            is_limit[i] = True
+        filters.append(value.get('filter', ''))
+    return {
+        'target_id': target_id,
+        'mjd': seconds / 86400. + UNIX_EPOCH_MJD,
+        'filter': np.asarray(filters, dtype=str),
+        'mag': mag,
+        'magerr': magerr,
+        'is_limit': is_limit,
+    }
+
+
+def concatenate_lightcurves(parts):
+    if not parts:
+        return rows_to_lightcurves([])
+    return {col: np.concatenate([part[col] for part in parts]) for col in LIGHTCURVE_COLUMNS}
+
+
+def photometry_rows(targets, source_name=None):
+    """Queryset of (target_id, timestamp, value) for the photometry
+    of targets, ordered by target and time.
+    """
+    datums = ReducedDatum.objects.filter(target__in=targets, data_type='photometry')
+    if source_name is not None:
+        datums = datums.filter(source_name=source_name)
+    return datums.order_by('target_id', 'timestamp').values_list('target_id', 'timestamp', 'value')
+
+
+def project_targets(project, targets=None):
+    """IDs of the project's targets, restricted to the queryset targets
+    when given, e.g. to those a user may view.
+    """
+    members = project.targets.all()
+    if targets is not None:
+        members = members.filter(id__in=targets.values('id'))
+    return members.values('id')
+
+
+def pack_lightcurve(lightcurve):
+    """Pack the points of one lightcurve into bytes, sorted by MJD.
+    Returns the bytes and the list of filter names their filter
+    codes index.
+    """
+    filters, codes = np.unique(lightcurve['filter'], return_inverse=True)
+    points = np.empty(len(lightcurve['mjd']), dtype=PACKED_DTYPE)
+    for col in PACKED_DTYPE.names:
+        points[col] = codes if col == 'filter' else lightcurve[col]
+    points.sort(order='mjd', kind='stable')
+    return points.tobytes(), filters.tolist()
+
+
+def unpack_lightcurve(data, filters, target_id):
+    """Column arrays of a packed lightcurve."""
+    points = np.frombuffer(data, dtype=PACKED_DTYPE)
+    return {
+        'target_id': np.full(len(points), target_id, dtype=np.int64),
+        'mjd': points['mjd'].astype(float),
+        'filter': np.asarray(filters, dtype=str)[points['filter']],
+        'mag': points['mag'].astype(float),
+        'magerr': points['magerr'].astype(float),
+        'is_limit': points['is_limit'].copy(),
+    }
+
+
+def update_packed_lightcurve(target, source_name, new_rows):
+    """Merge new (target_id, timestamp, value) rows, just written as
+    ReducedDatums, into the packed lightcurve of target and source.
+    A missing packed lightcurve is rebuilt from ReducedDatum instead,
+    so the store fills in for photometry ingested before it existed.
+    """
+    with transaction.atomic():
+        packed = PackedLightcurve.objects.select_for_update().filter(
+            target=target, source_name=source_name
+        ).first()
+        if packed is None:
+            return rebuild_packed_lightcurve(target, source_name)
+        if not new_rows:
+            return packed
+        lightcurve = concatenate_lightcurves([
+            unpack_lightcurve(packed.data, packed.filters, target.id), rows_to_lightcurves(new_rows)
+        ])
+        packed.data, packed.filters = pack_lightcurve(lightcurve)
+        packed.n_points = len(lightcurve['mjd'])
+        packed.save()
+        return packed
+
+
+def rebuild_packed_lightcurve(target, source_name):
+    """(Re)write the packed lightcurve of target and source from ReducedDatum."""
+    lightcurve = rows_to_lightcurves(list(photometry_rows([target.id], source_name)))
+    data, filters = pack_lightcurve(lightcurve)
+    packed, _ = PackedLightcurve.objects.update_or_create(
+        target=target,
+        source_name=source_name,
+        defaults={'data': data, 'filters': filters, 'n_points': len(lightcurve['mjd'])},
+    )
+    return packed
+
+
+def target_lightcurve(target, source_name):
+    """Photometry of target from one source as column arrays, read from
+    the packed store in a single fetch. A missing or invalidated
+    packed lightcurve is rebuilt from ReducedDatum first.
+    """
+    if not PACKED_LIGHTCURVES:
+        return rows_to_lightcurves(list(photometry_rows([target.id], source_name)))
+    packed = PackedLightcurve.objects.filter(target=target, source_name=source_name).first()
+    if packed is None:
+        packed = rebuild_packed_lightcurve(target, source_name)
+    return unpack_lightcurve(packed.data, packed.filters, target.id)
+
+
+def project_lightcurves(project, source_name=None, targets=None):
+    """All photometry of a project's targets, or of those also in the
+    queryset targets, as column arrays (see LIGHTCURVE_COLUMNS). Reads
+    ReducedDatum with a single query; with source_name, reads packed
+    lightcurves instead and falls back to ReducedDatum only for
+    targets without one.
+    """
+    members = project_targets(project, targets)
+    if source_name is None or not PACKED_LIGHTCURVES:
+        return rows_to_lightcurves(list(photometry_rows(members, source_name)))
+
+    parts = [
+        unpack_lightcurve(data, filters, target_id)
+        for target_id, data, filters in PackedLightcurve.objects.filter(
+            target__in=members, source_name=source_name
+        ).values_list('target_id', 'data', 'filters')
+    ]
+    missing = Target.objects.filter(id__in=members).exclude(
+        packed_lightcurves__source_name=source_name
+    ).values('id')
+    parts.append(rows_to_lightcurves(list(photometry_rows(missing, source_name))))
+
+    lightcurves = concatenate_lightcurves(parts)
+    order = np.argsort(lightcurves['target_id'], kind='stable')
+    return {col: values[order] for col, values in lightcurves.items()}
+
+
+def iter_project_lightcurves(project, chunk_size=LIGHTCURVE_CHUNK_SIZE, targets=None):
+    """Stream a project's photometry, restricted to the queryset targets
+    when given, as column-array chunks of at most chunk_size points,
+    without materializing the whole result.
+    """
+    chunk = []
+    for row in photometry_rows(project_targets(project, targets)).iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield rows_to_lightcurves(chunk)
+            chunk = []
+    if chunk:
+        yield rows_to_lightcurves(chunk)
+
+
+def split_by_target(lightcurves):
+    """Split column arrays sorted by target_id into
+    a dict of per-target column arrays.
+    """
+    target_ids, starts = np.unique(lightcurves['target_id'], return_index=True)
+    bounds = np.append(starts, len(lightcurves['target_id']))
+    return {
+        int(tid): {col: values[bounds[i]:bounds[i + 1]] for col, values in lightcurves.items()}
+        for i, tid in enumerate(target_ids)
+    }
+
+
+def lightcurves_to_arrow(lightcurves):
+    """Convert column arrays to a pyarrow Table. Requires pyarrow."""
+    import pyarrow as pa
+    return pa.table({col: lightcurves[col] for col in LIGHTCURVE_COLUMNS})
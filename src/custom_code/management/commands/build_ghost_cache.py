@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from custom_code.ghost import (
+    GHOST_CSV,
+    build_column_cache,
+    cache_is_stale,
+    column_cache_dir,
+)
+
+
+class Command(BaseCommand):
+    help = 'Converts the GHOST catalog CSV into a memory-mappable columnar cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--csv',
+            default=GHOST_CSV,
+            help='Path to the GHOST catalog CSV.'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Rebuild even if the existing cache is up to date.'
+        )
+
+    def handle(self, *args, **options):
+        csv_path = options['csv']
+        cache_dir = column_cache_dir(csv_path)
+
+        if not options['force'] and not cache_is_stale(csv_path, cache_dir):
+            self.stdout.write(f'Column cache at {cache_dir} is up to date.')
+            return
+
+        manifest = build_column_cache(csv_path, cache_dir)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(manifest['columns'])} columns x {manifest['n_rows']} rows to {cache_dir}."
+        ))
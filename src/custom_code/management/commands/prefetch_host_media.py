@@ -0,0 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+
+from custom_code.host_cache import DEFAULT_FILTERS, get_host_cache
+from custom_code.http_client import get_http_client
+from custom_code.models import HostGalaxy
+
+
+class Command(BaseCommand):
+    help = 'Downloads host galaxy images and NED spectra into the host media cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Include hosts not associated with any target.'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Re-download media that is already cached.'
+        )
+        parser.add_argument(
+            '--filters',
+            default=DEFAULT_FILTERS,
+            help='PS1 filter set of the cutout images.'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of concurrent downloads.'
+        )
+
+    def handle(self, *args, **options):
+        cache = get_host_cache()
+        filters = options['filters']
+
+        hosts = HostGalaxy.objects.all()
+        if not options['all']:
+            hosts = hosts.filter(aux_objects__isnull=False).distinct()
+        if not options['force']:
+            hosts = [
+                host for host in hosts
+                if not (cache.has_image(host.ID, filters) and cache.has_spectra(host.ID))
+            ]
+        hosts = list(hosts)
+        self.stdout.write(f'Fetching media for {len(hosts)} hosts.')
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+            futures = {
+                executor.submit(cache.fetch, host, filters, options['force']): host
+                for host in hosts
+            }
+            for future in as_completed(futures):
+                host = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    failed.append(host.name)
+                    self.stderr.write(f'Failed to fetch media for {host.name}: {e}')
+
+        for line in get_http_client().metrics.summary():
+            self.stdout.write(line)
+        n_evicted = cache.evict()
+        self.stdout.write(self.style.SUCCESS(
+            f'Cached media for {len(hosts) - len(failed)} hosts, {len(failed)} failed, '
+            f'evicted {n_evicted} files ({cache.size()} bytes in cache).'
+        ))
@@ -0,0 +1,77 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from custom_code.filters.engine import FilterEngine
+from custom_code.hook_queue import (
+    HOOK_QUEUE_BATCH_SIZE,
+    HOOK_QUEUE_CLAIM_TIMEOUT,
+    HOOK_QUEUE_MAX_ATTEMPTS,
+    claimable_count,
+    pending_count,
+    process_batch,
+)
+
+
+class Command(BaseCommand):
+    help = 'Runs queued target post-save work (the target filters) in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=HOOK_QUEUE_BATCH_SIZE,
+            help='Number of targets claimed per batch.'
+        )
+        parser.add_argument(
+            '--forever',
+            action='store_true',
+            help='Keep polling for new tasks instead of exiting once the queue is empty.'
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=5.,
+            help='Seconds to wait between polls of an empty queue with --forever.'
+        )
+        parser.add_argument(
+            '--claim-timeout',
+            type=int,
+            default=HOOK_QUEUE_CLAIM_TIMEOUT,
+            help='Seconds after which a claimed task is considered abandoned.'
+        )
+        parser.add_argument(
+            '--max-attempts',
+            type=int,
+            default=HOOK_QUEUE_MAX_ATTEMPTS,
+            help='Tasks that failed this many times are left in the queue for inspection.'
+        )
+
+    def handle(self, *args, **options):
+        engine = FilterEngine()
+        n_processed = 0
+        start = time.perf_counter()
+        try:
+            while True:
+                n = process_batch(
+                    engine,
+                    batch_size=options['batch_size'],
+                    timeout=options['claim_timeout'],
+                    max_attempts=options['max_attempts'],
+                )
+                n_processed += n
+                # a failed batch also processes nothing, but its tasks are released to retry
+                if n or claimable_count(options['claim_timeout'], options['max_attempts']):
+                    continue
+                if not options['forever']:
+                    break
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            engine.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {n_processed} targets in {time.perf_counter() - start:.2f} s, '
+            f'{pending_count(options["max_attempts"])} still pending.'
+        ))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from custom_code.models import ProjectTargetList
+from custom_code.pagination import invalidate_target_count
+from custom_code.project_summary import rebuild_project_summary
+
+
+class Command(BaseCommand):
+    help = ('Recomputes the summary statistics of projects from their targets, and drops their cached '
+            'target counts, e.g. after targets were written with bulk_create or permissions changed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--project',
+            type=int,
+            help='ID of a single project to rebuild.'
+        )
+
+    def handle(self, *args, **options):
+        projects = ProjectTargetList.objects.all()
+        if options['project'] is not None:
+            projects = projects.filter(id=options['project'])
+
+        invalidate_target_count('all')
+        for project in projects:
+            summary = rebuild_project_summary(project)
+            invalidate_target_count(project.id)
+            self.stdout.write(f'{project.name}: {summary.target_count} targets')
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(projects)} project summaries.'))
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from tom_targets.models import Target
+
+from custom_code.filters.engine import FILTER_BATCH_SIZE, run_filters
+
+
+class Command(BaseCommand):
+    help = 'Runs target filters over many targets in batches and writes their results to target extras.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--filter',
+            action='append',
+            dest='filters',
+            help='Name of a filter to run; may be repeated. Defaults to all filters.'
+        )
+        parser.add_argument(
+            '--target_id',
+            action='append',
+            type=int,
+            help='ID of a target to filter; may be repeated. Defaults to all targets.'
+        )
+        parser.add_argument(
+            '--project',
+            help='Only filter targets in the project with this ID.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=FILTER_BATCH_SIZE,
+            help='Number of targets per batch.'
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=0,
+            help='Size of the process pool for CPU-bound filters; 0 runs them in-process.'
+        )
+
+    def handle(self, *args, **options):
+        targets = Target.objects.all()
+        if options['target_id']:
+            targets = targets.filter(id__in=options['target_id'])
+        if options['project']:
+            targets = targets.filter(targetlist__id=options['project'])
+
+        report = run_filters(
+            targets.distinct(),
+            names=options['filters'],
+            batch_size=options['batch_size'],
+            processes=options['processes'],
+        )
+        for name, stats in report['filters'].items():
+            self.stdout.write(
+                f"{name}: {stats['calls']} batches, {stats['errors']} failed, {stats['total_time']:.2f} s"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Filtered {report['targets']} targets in {report['elapsed']:.2f} s "
+            f"({report['targets_per_second']:.1f} targets/s), wrote {report['extras_written']} extras."
+        ))
@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from custom_code.filter_helper import ALERT_INGEST_WORKERS
+from custom_code.requery_jobs import claim_next_job, fail_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = 'Runs queued broker requery jobs, such as those started from the Requery Broker button.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--forever',
+            action='store_true',
+            help='Keep polling for new jobs instead of exiting once none are queued.'
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=5.,
+            help='Seconds to wait between polls with --forever.'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=ALERT_INGEST_WORKERS,
+            help='Number of concurrent broker requests.'
+        )
+        parser.add_argument(
+            '--recover',
+            action='store_true',
+            help='First mark jobs left running by a stopped worker as failed.'
+        )
+
+    def handle(self, *args, **options):
+        if options['recover']:
+            n = fail_stale_jobs()
+            if n:
+                self.stdout.write(f'Marked {n} abandoned jobs as failed.')
+
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if not options['forever']:
+                    break
+                time.sleep(options['sleep'])
+                continue
+
+            self.stdout.write(f'Running requery job {job.id}.')
+            job = run_job(job, workers=options['workers'])
+            style = self.style.SUCCESS if job.status == job.DONE else self.style.ERROR
+            self.stdout.write(style(f'Requery job {job.id} {job.status} after {job.elapsed():.1f} s.'))
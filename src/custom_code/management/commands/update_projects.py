@@ -2,9 +2,12 @@ from django.core.management.base import BaseCommand
 from tom_alerts.alerts import get_service_class
 
 from custom_code.filter_helper import (
-    save_alerts_to_group,
+    ALERT_INGEST_WORKERS,
+    LocusCache,
+    save_alerts_to_groups,
     update_all_hosts,
 )
+from custom_code.http_client import get_http_client
 from custom_code.models import (
     ProjectTargetList,
 )
@@ -13,12 +16,28 @@ from custom_code.models import (
 class Command(BaseCommand):
     help = 'Performs an automatic nightly requery for all existing projects.'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=ALERT_INGEST_WORKERS,
+            help='Number of concurrent broker requests.'
+        )
+
     def handle(self, *args, **options):
         broker_name = 'ANTARES'  # hard-coded for now
         broker = get_service_class(broker_name)()
 
-        for project in ProjectTargetList.objects.all():
-            save_alerts_to_group(project, broker)
+        # loci matched by several projects are fetched and saved once per run
+        cache = LocusCache()
+        report = save_alerts_to_groups(
+            ProjectTargetList.objects.all(), broker, workers=options['workers'], cache=cache
+        )
+        failed = [name for name, result in report.items() if 'error' in result]
+        if failed:
+            self.stdout.write(self.style.ERROR(f"Failed to query projects: {', '.join(failed)}"))
 
         update_all_hosts()
+        for line in get_http_client().metrics.summary():
+            self.stdout.write(line)
         self.stdout.write(self.style.SUCCESS('Successfully updated all existing projects.'))
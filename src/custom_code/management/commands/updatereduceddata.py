@@ -1,8 +1,48 @@
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.management.base import BaseCommand
 from tom_alerts import alerts
 from tom_targets.models import Target
 
+from custom_code.http_client import RETRY_STATUSES
+from custom_code.models import PackedLightcurve, PhotometrySyncState
+
+CHECKPOINT_FILE = os.path.join(settings.MEDIA_ROOT, 'updatereduceddata.checkpoint')
+
+
+def is_transient(error):
+    """Whether error is a transport failure that a retry may fix."""
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in RETRY_STATUSES
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError))
+
+
+def with_retries(func, *args, retries=3, backoff=1.):
+    """Call func, retrying transport failures with jittered exponential
+    backoff. Any other error is raised at once.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return func(*args)
+        except Exception as e:
+            if attempt == retries or not is_transient(e):
+                raise
+            time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def read_checkpoint(path):
+    """IDs of the targets already completed by an interrupted run."""
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {int(line) for line in f if line.strip()}
+
 
 class Command(BaseCommand):
     help = 'Gets and updates time-series data for alert-generated targets from the original alert source.'
@@ -11,6 +51,71 @@ class Command(BaseCommand):
         parser.add_argument(
             '--target_id',
         )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Ignore sync watermarks, re-check the full alert history of each target '
+                 'and rebuild its packed lightcurves.'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of targets fetched from the brokers concurrently.'
+        )
+        parser.add_argument(
+            '--retries',
+            type=int,
+            default=3,
+            help='Retries of transport errors per target before it is reported as failed.'
+        )
+        parser.add_argument(
+            '--backoff',
+            type=float,
+            default=1.,
+            help='Base delay in seconds between retries, doubled on each attempt.'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default=CHECKPOINT_FILE,
+            help='File recording completed targets, so an interrupted run can resume.'
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore an existing checkpoint and process every target.'
+        )
+
+    def fetch_target(self, target, broker_classes, retries, backoff):
+        """Fetch reduced data for target from every broker that supports
+        fetching separately from processing. Runs on a worker thread.
+        """
+        fetched = {}
+        for class_name, clazz in broker_classes.items():
+            if hasattr(clazz, 'fetch_reduced_data'):
+                fetched[class_name] = with_retries(
+                    clazz.fetch_reduced_data, target, retries=retries, backoff=backoff
+                )
+        return fetched
+
+    def process_target(self, target, broker_classes, fetched, retries, backoff, not_found):
+        """Write reduced data for target. Runs on the main thread only.
+        Brokers that fetched nothing for target are skipped and the
+        target is added to not_found.
+        """
+        n_datums = 0
+        for class_name, clazz in broker_classes.items():
+            if class_name in fetched and fetched[class_name] is None:
+                not_found.append(f'{target.name} ({class_name})')
+                continue
+            if class_name in fetched:
+                n_new = with_retries(
+                    clazz.process_reduced_data, target, fetched[class_name], retries=retries, backoff=backoff
+                )
+            else:
+                n_new = with_retries(clazz.process_reduced_data, target, retries=retries, backoff=backoff)
+            n_datums += n_new or 0
+        return n_datums
 
     def handle(self, *args, **options):
         brokers = alerts.get_service_classes()
@@ -23,17 +128,70 @@ class Command(BaseCommand):
         # sources = [s.source_name for s in ReducedDatum.objects.filter(source_name__in=broker_classes.keys()).distinct()]
         if options['target_id']:
             try:
-                targets = [Target.objects.get(pk=options['target_id'])]
+                targets = Target.objects.filter(pk=Target.objects.get(pk=options['target_id']).pk)
             except ObjectDoesNotExist:
                 raise Exception('Invalid target id provided')
         else:
             targets = Target.objects.all()
 
-        try:
-            for target in targets:
-                for class_name, clazz in broker_classes.items():
-                    clazz.process_reduced_data(target)
-            return 'Update completed successfully'
+        checkpoint = options['checkpoint']
+        if options['restart'] and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        done = read_checkpoint(checkpoint)
+        if done:
+            print(f'Resuming from checkpoint, skipping {len(done)} completed targets.')
+        targets = list(targets.exclude(pk__in=done).order_by('pk'))
+
+        if options['full']:
+            PhotometrySyncState.objects.filter(target__in=targets).delete()
+            PackedLightcurve.objects.filter(target__in=targets).delete()
+
+        retries, backoff = options['retries'], options['backoff']
+        failed = {}
+        not_found = []
+        n_done = n_datums = 0
+        start = time.perf_counter()
+
+        os.makedirs(os.path.dirname(os.path.abspath(checkpoint)), exist_ok=True)
+        workers = max(options['workers'], 1)
+        pending = iter(targets)
+        with open(checkpoint, 'a') as checkpoint_file, ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            while True:
+                # keep a bounded number of fetches in flight so that
+                # fetched data never piles up ahead of the writer
+                for target in pending:
+                    futures[executor.submit(self.fetch_target, target, broker_classes, retries, backoff)] = target
+                    if len(futures) >= 2 * workers:
+                        break
+                if not futures:
+                    break
+
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    target = futures.pop(future)
+                    try:
+                        n_datums += self.process_target(
+                            target, broker_classes, future.result(), retries, backoff, not_found
+                        )
+                    except Exception as e:
+                        failed[target.name] = str(e)
+                        continue
+                    n_done += 1
+                    checkpoint_file.write(f'{target.pk}\n')
+                    checkpoint_file.flush()
+
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        self.stdout.write(
+            f'Updated {n_done} targets ({n_done / elapsed:.2f} targets/s), '
+            f'{n_datums} new datums ({n_datums / elapsed:.2f} datums/s) in {elapsed:.1f} s.'
+        )
+        if not_found:
+            self.stdout.write(self.style.WARNING(f'Not found at their broker: {", ".join(not_found)}'))
+        if failed:
+            for name, error in failed.items():
+                self.stdout.write(self.style.ERROR(f'{name}: {error}'))
+            return 'Update completed with errors: {0}'.format(', '.join(failed))
 
-        except:
-            return 'Update completed with errors: {0}'.format(str(failed_records))
+        os.remove(checkpoint)
+        return 'Update completed successfully'
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tom_targets', '0020_alter_targetname_created_alter_targetname_modified'),
+        ('custom_code', '0002_alter_hostgalaxy_catalog'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='queryproperty',
+            name='queryset',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='properties', to='custom_code.queryset'),
+        ),
+        migrations.AlterField(
+            model_name='querytag',
+            name='queryset',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tags', to='custom_code.queryset'),
+        ),
+        migrations.CreateModel(
+            name='PhotometrySyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_name', models.CharField(help_text='Name of the broker the alerts came from', max_length=100)),
+                ('last_mjd', models.FloatField(help_text='MJD of the newest ingested alert', null=True)),
+                ('last_alert_id', models.CharField(help_text='ID of the newest ingested alert', max_length=100, null=True)),
+                ('modified', models.DateTimeField(auto_now=True, help_text='The time at which this target was last synced.')),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_states', to='tom_targets.target')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='photometrysyncstate',
+            constraint=models.UniqueConstraint(fields=('target', 'source_name'), name='one_sync_state_per_source'),
+        ),
+    ]
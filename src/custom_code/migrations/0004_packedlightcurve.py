@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tom_targets', '0020_alter_targetname_created_alter_targetname_modified'),
+        ('custom_code', '0003_photometrysyncstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PackedLightcurve',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_name', models.CharField(help_text='Name of the source of the photometry', max_length=100)),
+                ('n_points', models.IntegerField(default=0, help_text='Number of photometry points')),
+                ('data', models.BinaryField(help_text='Packed photometry points, sorted by MJD')),
+                ('modified', models.DateTimeField(auto_now=True, help_text='The time at which this lightcurve was last written.')),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='packed_lightcurves', to='tom_targets.target')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='packedlightcurve',
+            constraint=models.UniqueConstraint(fields=('target', 'source_name'), name='one_packed_lightcurve_per_source'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tom_targets', '0020_alter_targetname_created_alter_targetname_modified'),
+        ('custom_code', '0004_packedlightcurve'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TargetHookTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('enqueued', models.DateTimeField(help_text='The time at which this target was last enqueued.')),
+                ('claimed_at', models.DateTimeField(help_text='The time at which a worker claimed this task.', null=True)),
+                ('claimed_by', models.CharField(blank=True, default='', help_text='Token of the worker holding this task', max_length=32)),
+                ('attempts', models.IntegerField(default=0, help_text='Number of failed attempts')),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('target', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='hook_task', to='tom_targets.target')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['claimed_at', 'enqueued'], name='hook_task_pending')],
+            },
+        ),
+    ]
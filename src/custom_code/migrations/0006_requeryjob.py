@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custom_code', '0005_targethooktask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequeryJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('active', models.BooleanField(default=True, help_text='Whether the job is queued or running')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(null=True)),
+                ('finished', models.DateTimeField(null=True)),
+                ('projects', models.JSONField(default=dict, help_text='Per-project alert counts, timings and errors')),
+                ('hosts', models.JSONField(default=dict, help_text='Host matching statistics')),
+                ('error', models.TextField(blank=True, default='')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='requeryjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('active', True)), fields=('active',), name='one_active_requery_job'),
+        ),
+    ]
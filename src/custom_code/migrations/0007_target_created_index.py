@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Index the (created, id) order that keyset pagination of the
+    target lists seeks on. Target belongs to tom_targets, so the
+    index is created with SQL.
+    """
+
+    dependencies = [
+        ('custom_code', '0006_requeryjob'),
+        ('tom_targets', '0020_alter_targetname_created_alter_targetname_modified'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS custom_code_target_created_id '
+            'ON tom_targets_target (created, id);',
+            'DROP INDEX IF EXISTS custom_code_target_created_id;'
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custom_code', '0007_target_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectSummary',
+            fields=[
+                ('project', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='custom_code.projecttargetlist')),
+                ('target_count', models.IntegerField(default=0)),
+                ('newest_alert_mjd', models.FloatField(help_text='MJD of the newest alert ingested for any target', null=True)),
+                ('type_counts', models.JSONField(default=dict, help_text='Number of targets of each SN type')),
+                ('sky_histogram', models.JSONField(default=list, help_text='Target counts in declination rows of right ascension bins')),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:57
+
+from django.db import migrations, models
+
+
+def drop_grid_summaries(apps, schema_editor):
+    """Summaries are rebuilt on first use with HEALPix histograms."""
+    apps.get_model('custom_code', 'ProjectSummary').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custom_code', '0008_projectsummary'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='projectsummary',
+            name='sky_histogram',
+            field=models.JSONField(default=list, help_text='Target counts per nested HEALPix pixel, at SKY_DENSITY_NSIDE'),
+        ),
+        migrations.RunPython(drop_grid_summaries, migrations.RunPython.noop),
+    ]
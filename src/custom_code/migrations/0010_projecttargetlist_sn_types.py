@@ -0,0 +1,55 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:02
+
+from django.db import migrations, models
+
+
+def copy_sn_type(apps, schema_editor):
+    """Give each project the SN type its sn_type field held."""
+    ProjectTargetList = apps.get_model('custom_code', 'ProjectTargetList')
+    SNType = apps.get_model('custom_code', 'SNType')
+    for project in ProjectTargetList.objects.exclude(sn_type=''):
+        sn_type, _ = SNType.objects.get_or_create(sn_type=project.sn_type.strip())
+        project.sn_types.add(sn_type)
+
+
+def copy_sn_types(apps, schema_editor):
+    """Put the first SN type of each project back in its sn_type field."""
+    ProjectTargetList = apps.get_model('custom_code', 'ProjectTargetList')
+    for project in ProjectTargetList.objects.prefetch_related('sn_types'):
+        sn_types = sorted(sn_type.sn_type for sn_type in project.sn_types.all())
+        if sn_types:
+            project.sn_type = sn_types[0]
+            project.save(update_fields=['sn_type'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custom_code', '0009_projectsummary_healpix'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SNType',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sn_type', models.CharField(help_text='The supernova type to check for', max_length=100, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='projecttargetlist',
+            name='sn_types',
+            field=models.ManyToManyField(to='custom_code.sntype'),
+        ),
+        migrations.RunPython(copy_sn_type, copy_sn_types),
+        # a default lets the column be added back when migrating backwards
+        migrations.AlterField(
+            model_name='projecttargetlist',
+            name='sn_type',
+            field=models.CharField(default='', help_text='The supernova type to check for.', max_length=100),
+        ),
+        migrations.RemoveField(
+            model_name='projecttargetlist',
+            name='sn_type',
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:11
+
+from django.db import migrations, models
+
+
+def drop_packed_lightcurves(apps, schema_editor):
+    """Packed points used to hold filter names, not codes; they are
+    rebuilt from ReducedDatum on next use.
+    """
+    apps.get_model('custom_code', 'PackedLightcurve').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custom_code', '0010_projecttargetlist_sn_types'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='packedlightcurve',
+            name='filters',
+            field=models.JSONField(default=list, help_text='Filter names, indexed by the filter codes of the packed points'),
+        ),
+        migrations.RunPython(drop_packed_lightcurves, migrations.RunPython.noop),
+    ]
@@ -1,12 +1,9 @@
 import glob
 import os
-import re
 import shutil
 from io import BytesIO
 
-import numpy as np
 import pandas as pd
-import requests
 from PIL import Image
 from astro_ghost.ghostHelperFunctions import (
     findNewHosts,
@@ -20,11 +17,14 @@ from django.db import models
 from django.db.models import OneToOneField
 from django.db.models import Q
 from django.db.models.constraints import CheckConstraint
+from django.utils import timezone
 from tom_targets.models import Target, TargetList
 
-STATIC_DIR = settings.STATICFILES_DIRS[0]
+from custom_code.ghost import GHOST_CSV, get_ghost_catalog
+from custom_code.http_client import get_http_client
+from custom_code.spectra import decode_ned_spectrum
+
 DATA_DIR = settings.MEDIA_ROOT
-GHOST_CSV = os.path.join(STATIC_DIR, "ghost/database/GHOST.csv")
 TMP_IMAGE_DIR = os.path.join(DATA_DIR, "tmp/host-images/")
 TMP_ASSOCIATION_DIR = os.path.join(DATA_DIR, "ghost-temp/")
 
@@ -80,36 +80,33 @@ class HostGalaxy(models.Model):
     def targets(self):
         return [x.target for x in self.aux_objects.all()]
 
+    def fetch_image(self, filters="grizy"):
+        """Get PNG bytes of the color image of the host galaxy.
+        """
+        url = geturl(self.ra, self.dec, filters=filters, format="png", color=True, type='stack')
+        r = get_http_client().get(url)
+        r.raise_for_status()
+        return r.content
+
     def add_image(self, filters="grizy"):
         """Get color image of host galaxy.
         """
-        url = geturl(self.ra, self.dec, filters=filters, format="png", color=True, type='stack')
-        r = requests.get(url)
-        im = Image.open(BytesIO(r.content))
-        return im
+        return Image.open(BytesIO(self.fetch_image(filters)))
+
+    def fetch_spectra(self):
+        """Get spectra of host galaxy from NED as a list of
+        (wavelength, flux, flux_err) arrays. Unlike add_spectra,
+        errors are raised.
+        """
+        return [decode_ned_spectrum(spectrum) for spectrum in Ned.get_spectra(self.name)]
 
     def add_spectra(self):
-        """Get spectra (list) of host galaxy,
-        if available, and save as ReducedDatum objects.
+        """Get spectra of host galaxy as (wavelength, flux, flux_err)
+        arrays, if available.
         """
 
         try:
-            spectra = Ned.get_spectra(self.name)
-
-            spec_data = []
-            for spectrum in spectra:
-                arr = spectrum[0].data.astype('float')
-                header = spectrum[0].header
-
-                flux = list(arr[0])
-                flux_err = list(arr[2])
-
-                wv0 = 10 ** header["COEFF0"]
-                delta_wv = 10 ** header["COEFF1"]
-                wv = [wv0 + i * delta_wv for i in range(len(flux))]
-                spec_data.append([wv, flux, flux_err])
-
-            return spec_data
+            return self.fetch_spectra()
 
         except Exception as e:
             print("Obtained error when trying to get spectra. Return empty list for now: ", e)
@@ -117,16 +114,12 @@ class HostGalaxy(models.Model):
 
     def query_from_csv(self, columns=None):
         """Query any properties not included in Model
-        object from host CSV. If columns is None, return
-        entire DataFrame row as dictionary.
+        object from the host catalog. If columns is None, return
+        all columns of the matching rows as a DataFrame.
         """
-        df = pd.read_csv(self.catalog)
-        host_df = df[df['NED_name'] == self.name]
-
-        if columns is not None:
-            return host_df[columns]
-
-        return host_df
+        catalog = get_ghost_catalog(self.catalog)
+        rows = catalog.index('NED_name').get(self.name, [])
+        return catalog.select(rows, columns)
 
 
 class HostGalaxyName(models.Model):
@@ -203,11 +196,13 @@ class TargetAux(models.Model):
         host_name = host['NED_name']
         host_ra = host['raMean']
         host_dec = host['decMean']
-        host_obj = HostGalaxy.create(
+        host_obj, _ = HostGalaxy.objects.get_or_create(
             ID=host_id,
-            name=host_name,
-            ra=host_ra,
-            dec=host_dec,
+            defaults={
+                'name': host_name,
+                'ra': host_ra,
+                'dec': host_dec,
+            }
         )
         self.host = host_obj
         self.save()
@@ -215,33 +210,20 @@ class TargetAux(models.Model):
     def search_for_host_galaxy(self):
         """Search for and add host galaxy info.
         """
-        fullTable = pd.read_csv(GHOST_CSV)
-        host = None
+        catalog = get_ghost_catalog()
 
         # search by transient name
-        transientName = re.sub(r"\s+", "", str(self.target.name))
-        possibleNames = [transientName, transientName.upper(), transientName.lower(), "SN" + transientName]
-        for name in possibleNames:
-            if len(fullTable[fullTable['TransientName'] == name]) > 0:
-                host = fullTable[fullTable['TransientName'] == name].iloc[0]
-                return self._add_host_from_df_row(host)
+        host = catalog.search_by_name(self.target.name)
+        if host is not None:
+            return self._add_host_from_df_row(host)
 
         # search by transient coord
         ra, dec = self.target.ra, self.target.dec
+        host = catalog.nearest(ra, dec, max_sep_arcsec=1.)
+        if host is not None:
+            return self._add_host_from_df_row(host)
+
         transientCoord = SkyCoord(ra=ra * u.degree, dec=dec * u.degree, frame='icrs')
-        smallTable = fullTable[np.abs(fullTable['TransientRA'] - transientCoord.ra.degree) < 0.1]
-        smallTable = smallTable[np.abs(smallTable['TransientDEC'] - transientCoord.dec.degree) < 0.1]
-        if len(smallTable) > 0:
-            c2 = SkyCoord(
-                smallTable['TransientRA'].values * u.deg,
-                smallTable['TransientDEC'].values * u.deg,
-                frame='icrs'
-            )
-            sep = np.array(transientCoord.separation(c2).arcsec)
-            if np.nanmin(sep) <= 1:
-                host_idx = np.where(sep == np.nanmin(sep))[0][0]
-                host = smallTable.iloc[host_idx]
-                return self._add_host_from_df_row(host)
 
         # search manually
         findNewHosts(
@@ -265,6 +247,181 @@ class TargetAux(models.Model):
         return None
 
 
+class PhotometrySyncState(models.Model):
+    """High-water mark of the alerts already ingested for
+    a target from one broker.
+    """
+    target = models.ForeignKey(
+        Target,
+        on_delete=models.CASCADE,
+        related_name="sync_states"
+    )
+    source_name = models.CharField(
+        max_length=100,
+        help_text="Name of the broker the alerts came from"
+    )
+    last_mjd = models.FloatField(
+        help_text="MJD of the newest ingested alert",
+        null=True,
+    )
+    last_alert_id = models.CharField(
+        max_length=100,
+        help_text="ID of the newest ingested alert",
+        null=True,
+    )
+    modified = models.DateTimeField(
+        auto_now=True,
+        help_text="The time at which this target was last synced."
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['target', 'source_name'],
+                name='one_sync_state_per_source'
+            )
+        ]
+
+
+class PackedLightcurve(models.Model):
+    """Photometry of a target from one source, packed into a single
+    binary array (see custom_code.lightcurves.PACKED_DTYPE). Mirrors
+    the photometry ReducedDatum rows of that target and source.
+    """
+    target = models.ForeignKey(
+        Target,
+        on_delete=models.CASCADE,
+        related_name="packed_lightcurves"
+    )
+    source_name = models.CharField(
+        max_length=100,
+        help_text="Name of the source of the photometry"
+    )
+    n_points = models.IntegerField(
+        default=0,
+        help_text="Number of photometry points"
+    )
+    data = models.BinaryField(
+        help_text="Packed photometry points, sorted by MJD"
+    )
+    filters = models.JSONField(
+        default=list,
+        help_text="Filter names, indexed by the filter codes of the packed points"
+    )
+    modified = models.DateTimeField(
+        auto_now=True,
+        help_text="The time at which this lightcurve was last written."
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['target', 'source_name'],
+                name='one_packed_lightcurve_per_source'
+            )
+        ]
+
+
+class TargetHookTask(models.Model):
+    """Pending post-save work for a target. There is at most one row
+    per target, so repeated saves coalesce into one task.
+    """
+    target = models.OneToOneField(
+        Target,
+        on_delete=models.CASCADE,
+        related_name="hook_task"
+    )
+    enqueued = models.DateTimeField(
+        help_text="The time at which this target was last enqueued."
+    )
+    claimed_at = models.DateTimeField(
+        null=True,
+        help_text="The time at which a worker claimed this task."
+    )
+    claimed_by = models.CharField(
+        max_length=32,
+        blank=True,
+        default='',
+        help_text="Token of the worker holding this task"
+    )
+    attempts = models.IntegerField(
+        default=0,
+        help_text="Number of failed attempts"
+    )
+    last_error = models.TextField(
+        blank=True,
+        default=''
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['claimed_at', 'enqueued'], name='hook_task_pending'),
+        ]
+
+
+class RequeryJob(models.Model):
+    """A run of the broker requery for all projects, executed by the
+    run_requery_jobs worker. At most one job is active at a time.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=QUEUED
+    )
+    active = models.BooleanField(
+        default=True,
+        help_text="Whether the job is queued or running"
+    )
+    created = models.DateTimeField(
+        auto_now_add=True
+    )
+    started = models.DateTimeField(
+        null=True
+    )
+    finished = models.DateTimeField(
+        null=True
+    )
+    projects = models.JSONField(
+        default=dict,
+        help_text="Per-project alert counts, timings and errors"
+    )
+    hosts = models.JSONField(
+        default=dict,
+        help_text="Host matching statistics"
+    )
+    error = models.TextField(
+        blank=True,
+        default=''
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['active'],
+                condition=Q(active=True),
+                name='one_active_requery_job'
+            )
+        ]
+
+    def elapsed(self):
+        """Seconds the job has been running, or ran for."""
+        if self.started is None:
+            return 0.
+        end = self.finished or timezone.now()
+        return (end - self.started).total_seconds()
+
+
 class SNType(models.Model):
     """Class representing a supernova type to associate with a project
     """
@@ -310,6 +467,39 @@ class ProjectTargetList(TargetList):
         return self.name
 
 
+class ProjectSummary(models.Model):
+    """Denormalized statistics of a project's targets, kept up to date
+    incrementally by custom_code.project_summary as targets are added,
+    removed, moved, classified or ingested. Writes that send no model
+    signals, such as bulk_update or QuerySet.update of target positions
+    or SN type extras, need rebuild_project_summaries afterwards.
+    """
+    project = models.OneToOneField(
+        ProjectTargetList,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="summary"
+    )
+    target_count = models.IntegerField(
+        default=0
+    )
+    newest_alert_mjd = models.FloatField(
+        null=True,
+        help_text="MJD of the newest alert ingested for any target"
+    )
+    type_counts = models.JSONField(
+        default=dict,
+        help_text="Number of targets of each SN type"
+    )
+    sky_histogram = models.JSONField(
+        default=list,
+        help_text="Target counts per nested HEALPix pixel, at SKY_DENSITY_NSIDE"
+    )
+    modified = models.DateTimeField(
+        auto_now=True
+    )
+
+
 class QuerySet(models.Model):
     """Set of query properties and tags.
     """
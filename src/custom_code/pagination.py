@@ -0,0 +1,198 @@
+import base64
+import uuid
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+KEYSET_PAGINATION = getattr(settings, 'KEYSET_PAGINATION', True)
+# seconds a cached target count is trusted; bounds staleness from
+# changes no signal reports, e.g. bulk_create or permission edits,
+# which rebuild_project_summaries also clears (see settings.py)
+TARGET_COUNT_TTL = getattr(settings, 'TARGET_COUNT_TTL', 300)
+# query parameters that select a page rather than filter targets
+PAGE_PARAMS = ('page', 'cursor', 'before')
+
+
+def encode_cursor(target):
+    value = f"{target.created.isoformat()}|{target.id}"
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(token):
+    """Return the (created, id) position of a cursor token."""
+    try:
+        created, target_id = base64.urlsafe_b64decode(token.encode()).decode().split('|')
+        return datetime.fromisoformat(created), int(target_id)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise Http404('Invalid cursor.')
+
+
+def invalidate_target_count(scope):
+    """Drop the cached counts of scope, a project id or 'all'. Counts are
+    cached per user under a version key, so replacing the version
+    invalidates every user's count at once.
+    """
+    cache.set(f'target_count_version:{scope}', uuid.uuid4().hex, None)
+
+
+def count_version(scope):
+    """Current cache version of scope, for keys derived from its targets."""
+    version_key = f'target_count_version:{scope}'
+    version = cache.get(version_key)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(version_key, version, None)
+    return version
+
+
+def filter_scope(params):
+    """Cache scope of the target filter in the query params: the project
+    id when only targetlist__name is filtered, 'all' when nothing is,
+    else None.
+    """
+    filters = {key: value for key, value in params.items() if value and key not in PAGE_PARAMS}
+    if not filters:
+        return 'all'
+    if set(filters) == {'targetlist__name'} and filters['targetlist__name'].isdigit():
+        return int(filters['targetlist__name'])
+    return None
+
+
+def cached_target_count(scope, user, queryset, name='target_count'):
+    """queryset.count(), cached per user under name until the targets
+    of scope change.
+    """
+    key = f'{name}:{scope}:{count_version(scope)}:{user.pk}'
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, TARGET_COUNT_TTL)
+    return count
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator whose count comes from count_func when given."""
+
+    def __init__(self, object_list, per_page, count_func=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_func = count_func
+
+    @cached_property
+    def count(self):
+        if self.count_func is None:
+            return Paginator.count.func(self)
+        return self.count_func()
+
+
+class CursorPage:
+    """A page of targets ordered by (-created, -id), located by the
+    position of a neighbouring row instead of an offset.
+    """
+    is_keyset = True
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.object_list[-1]) if self._has_next else None
+
+    @property
+    def previous_cursor(self):
+        return encode_cursor(self.object_list[0]) if self._has_previous else None
+
+
+def keyset_page(queryset, paginator, page_size, cursor=None, before=None):
+    """Targets after cursor, or before before, in (-created, -id) order.
+    Each page costs one indexed range query however deep it is.
+    """
+    if before is not None:
+        created, target_id = decode_cursor(before)
+        rows = list(
+            queryset.filter(Q(created__gt=created) | Q(created=created, id__gt=target_id))
+            .order_by('created', 'id')[:page_size + 1]
+        )
+        has_previous = len(rows) > page_size
+        return CursorPage(rows[:page_size][::-1], paginator, bool(rows), has_previous)
+
+    if cursor is not None:
+        created, target_id = decode_cursor(cursor)
+        queryset = queryset.filter(Q(created__lt=created) | Q(created=created, id__lt=target_id))
+    rows = list(queryset.order_by('-created', '-id')[:page_size + 1])
+    return CursorPage(rows[:page_size], paginator, len(rows) > page_size, cursor is not None)
+
+
+class KeysetPaginationMixin:
+    """Pages a target list view by cursor instead of offset, and takes
+    the target count from a cache invalidated on membership changes.
+
+    Offset pages are still served for ?page= and for orderings other
+    than the default, e.g. ?order=name.
+    """
+
+    def get_target_count(self, queryset):
+        scope = filter_scope(self.request.GET)
+        if scope is None:
+            return queryset.count()
+        return cached_target_count(scope, self.request.user, queryset)
+
+    def use_keyset(self):
+        return KEYSET_PAGINATION and not self.request.GET.get('page') and not self.request.GET.get('order')
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        return CachedCountPaginator(
+            queryset, per_page, count_func=lambda: self.get_target_count(queryset),
+            orphans=orphans, allow_empty_first_page=allow_empty_first_page, **kwargs
+        )
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.use_keyset():
+            return super().paginate_queryset(queryset, page_size)
+        paginator = self.get_paginator(queryset, page_size)
+        page = keyset_page(
+            queryset, paginator, page_size,
+            cursor=self.request.GET.get('cursor') or None,
+            before=self.request.GET.get('before') or None
+        )
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def page_url(self, **params):
+        query = self.request.GET.copy()
+        for key in PAGE_PARAMS:
+            query.pop(key, None)
+        query.update(params)
+        return f"?{query.urlencode()}"
+
+    def get_context_data(self, *args, **kwargs):
+        context = super().get_context_data(*args, **kwargs)
+        page = context.get('page_obj')
+        if getattr(page, 'is_keyset', False):
+            context['first_page_url'] = self.page_url() if page.has_previous() else None
+            context['previous_page_url'] = (
+                self.page_url(before=page.previous_cursor) if page.has_previous() else None
+            )
+            context['next_page_url'] = self.page_url(cursor=page.next_cursor) if page.has_next() else None
+        return context
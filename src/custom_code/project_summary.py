@@ -0,0 +1,152 @@
+import numpy as np
+from astropy_healpix import nside_to_npix
+from django.db import transaction
+from django.db.models import Max, Q
+from tom_targets.models import Target, TargetExtra
+
+from custom_code.models import PhotometrySyncState, ProjectSummary
+from custom_code.sky_density import SKY_DENSITY_NSIDE, healpix_counts
+
+# target extra holding the SN type the broker classified a target as
+SN_TYPE_EXTRA = 'superphot_plus_class'
+UNKNOWN_TYPE = 'Unknown'
+
+
+def empty_sky_histogram():
+    return [0] * nside_to_npix(SKY_DENSITY_NSIDE)
+
+
+def sky_position(ra, dec, target_type):
+    """(ra, dec) of a target as the sky map plots it; like the map,
+    the histogram leaves out non-sidereal targets.
+    """
+    return (ra, dec) if target_type == Target.SIDEREAL else (None, None)
+
+
+def target_stats(targets):
+    """(ra, dec, SN type, newest alert MJD) of each target in the
+    queryset targets, read with three queries. Non-sidereal targets
+    have no ra, dec.
+    """
+    types = dict(
+        TargetExtra.objects.filter(target__in=targets, key=SN_TYPE_EXTRA)
+        .values_list('target_id', 'value')
+    )
+    mjds = dict(
+        PhotometrySyncState.objects.filter(target__in=targets)
+        .values('target_id').annotate(mjd=Max('last_mjd'))
+        .values_list('target_id', 'mjd')
+    )
+    return [
+        (*sky_position(ra, dec, target_type), types.get(target_id) or UNKNOWN_TYPE, mjds.get(target_id))
+        for target_id, ra, dec, target_type in targets.values_list('id', 'ra', 'dec', 'type')
+    ]
+
+
+def _newest_alert_mjd(project_id, exclude_ids=()):
+    return PhotometrySyncState.objects.filter(
+        target__targetlist=project_id
+    ).exclude(target_id__in=exclude_ids).aggregate(mjd=Max('last_mjd'))['mjd']
+
+
+def _apply(summary, stats, sign):
+    """Add (sign=1) or subtract (sign=-1) the contribution of stats."""
+    histogram = np.array(summary.sky_histogram or empty_sky_histogram())
+    positions = [(ra, dec) for ra, dec, *_ in stats if ra is not None and dec is not None]
+    if positions:
+        ra, dec = zip(*positions)
+        histogram += sign * healpix_counts(ra, dec)
+    for *_, sn_type, _ in stats:
+        count = summary.type_counts.get(sn_type, 0) + sign
+        if count > 0:
+            summary.type_counts[sn_type] = count
+        else:
+            summary.type_counts.pop(sn_type, None)
+    summary.sky_histogram = histogram.tolist()
+    summary.target_count += sign * len(stats)
+
+
+def rebuild_project_summary(project):
+    """Recompute the summary of project from all its targets."""
+    summary = ProjectSummary(project=project, type_counts={}, sky_histogram=empty_sky_histogram())
+    _apply(summary, target_stats(project.targets.all()), 1)
+    summary.newest_alert_mjd = _newest_alert_mjd(project.id)
+    summary.save()
+    return summary
+
+
+def get_project_summary(project):
+    """The summary of project, built on first use by projects that
+    predate summaries.
+    """
+    try:
+        return project.summary
+    except ProjectSummary.DoesNotExist:
+        return rebuild_project_summary(project)
+
+
+def add_targets(project_id, targets):
+    """Fold the queryset targets, just added to the project, into its
+    summary. Projects without a summary yet are left to build theirs
+    on first use.
+    """
+    with transaction.atomic():
+        summary = ProjectSummary.objects.select_for_update().filter(project_id=project_id).first()
+        if summary is None:
+            return
+        stats = target_stats(targets)
+        _apply(summary, stats, 1)
+        mjds = [mjd for *_, mjd in stats if mjd is not None]
+        if mjds and (summary.newest_alert_mjd is None or max(mjds) > summary.newest_alert_mjd):
+            summary.newest_alert_mjd = max(mjds)
+        summary.save()
+
+
+def remove_targets(project_id, targets):
+    """Take the queryset targets, about to leave the project, out of its
+    summary. The newest alert MJD is only recomputed when a removed
+    target held it.
+    """
+    with transaction.atomic():
+        summary = ProjectSummary.objects.select_for_update().filter(project_id=project_id).first()
+        if summary is None:
+            return
+        stats = target_stats(targets)
+        _apply(summary, stats, -1)
+        newest = summary.newest_alert_mjd
+        if any(mjd is not None and newest is not None and mjd >= newest for *_, mjd in stats):
+            removed_ids = list(targets.values_list('id', flat=True))
+            summary.newest_alert_mjd = _newest_alert_mjd(project_id, exclude_ids=removed_ids)
+        summary.save()
+
+
+def replace_target(target_id, old_stats, new_stats):
+    """Swap the contribution of target_id to the summaries of its
+    projects from old_stats to new_stats, its (ra, dec, SN type)
+    before and after a save.
+    """
+    with transaction.atomic():
+        for summary in ProjectSummary.objects.select_for_update().filter(project__targets=target_id):
+            # adding first keeps a count the two share from dropping to zero
+            _apply(summary, [(*new_stats, None)], 1)
+            _apply(summary, [(*old_stats, None)], -1)
+            summary.save()
+
+
+def clear_summary(project_id):
+    """Reset the summary of a project that lost all its targets."""
+    ProjectSummary.objects.filter(project_id=project_id).update(
+        target_count=0, newest_alert_mjd=None, type_counts={}, sky_histogram=empty_sky_histogram()
+    )
+
+
+def record_alert_mjd(target_id, mjd):
+    """Advance the newest alert MJD of every project holding target_id."""
+    ProjectSummary.objects.filter(project__targets=target_id).filter(
+        Q(newest_alert_mjd__isnull=True) | Q(newest_alert_mjd__lt=mjd)
+    ).update(newest_alert_mjd=mjd)
+
+
+def project_targets(project_id, target_ids):
+    """Those of target_ids that are members of the project."""
+    return Target.objects.filter(id__in=target_ids, targetlist=project_id)
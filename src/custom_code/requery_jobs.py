@@ -0,0 +1,81 @@
+import logging
+import traceback
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from tom_alerts.alerts import get_service_class
+
+from custom_code.filter_helper import (
+    ALERT_INGEST_WORKERS,
+    LocusCache,
+    save_alerts_to_groups,
+    update_all_hosts
+)
+from custom_code.models import ProjectTargetList, RequeryJob
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_requery_job():
+    """Queue a requery of all projects, unless one is already queued or
+    running. Returns (job, created); concurrent callers share one job.
+    """
+    job = RequeryJob.objects.filter(active=True).first()
+    if job is not None:
+        return job, False
+    try:
+        with transaction.atomic():
+            return RequeryJob.objects.create(), True
+    except IntegrityError:
+        # another request created the active job first
+        return RequeryJob.objects.get(active=True), False
+
+
+def claim_next_job():
+    """Mark the queued job as running and return it, or None."""
+    job = RequeryJob.objects.filter(status=RequeryJob.QUEUED).order_by('created').first()
+    if job is None:
+        return None
+    n = RequeryJob.objects.filter(id=job.id, status=RequeryJob.QUEUED).update(
+        status=RequeryJob.RUNNING, started=timezone.now()
+    )
+    if not n:
+        return None  # claimed by another worker
+    job.refresh_from_db()
+    return job
+
+
+def run_job(job, broker_name='ANTARES', workers=ALERT_INGEST_WORKERS):
+    """Requery every project and update hosts, saving per-project
+    progress on job as each project finishes.
+    """
+    def on_project_done(name, result):
+        job.projects[name] = result
+        job.save(update_fields=['projects'])
+
+    try:
+        broker = get_service_class(broker_name)()
+        save_alerts_to_groups(
+            ProjectTargetList.objects.all(), broker,
+            workers=workers, cache=LocusCache(), on_project_done=on_project_done
+        )
+        job.hosts = update_all_hosts()
+        job.status = RequeryJob.DONE
+    except Exception:
+        logger.exception("Requery job %d failed.", job.id)
+        job.status = RequeryJob.FAILED
+        job.error = traceback.format_exc()
+    job.active = False
+    job.finished = timezone.now()
+    job.save()
+    return job
+
+
+def fail_stale_jobs():
+    """Mark jobs left running by a dead worker as failed, so they
+    no longer block new requeries. Call only when no worker is running.
+    """
+    return RequeryJob.objects.filter(status=RequeryJob.RUNNING).update(
+        status=RequeryJob.FAILED, active=False, finished=timezone.now(),
+        error='Worker stopped before the job finished.'
+    )
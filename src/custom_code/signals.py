@@ -0,0 +1,148 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from tom_dataproducts.models import ReducedDatum
+from tom_targets.models import Target, TargetExtra, TargetList
+
+from custom_code import project_summary
+from custom_code.models import PackedLightcurve, PhotometrySyncState, ProjectSummary, ProjectTargetList
+from custom_code.pagination import invalidate_target_count
+
+
+@receiver(post_save, sender=ReducedDatum)
+@receiver(post_delete, sender=ReducedDatum)
+def drop_stale_packed_lightcurve(sender, instance, origin=None, **kwargs):
+    """Saving or deleting photometry invalidates the packed copy of its
+    target and source, which is rebuilt on next use. Ingest writes
+    with bulk_create and merges into the packed copy itself.
+
+    A delete of many datums invalidates each target and source once,
+    and a target's own delete cascades to its packed lightcurves.
+    """
+    if instance.data_type != 'photometry' or isinstance(origin, Target):
+        return
+    key = (instance.target_id, instance.source_name)
+    if origin is not None:
+        invalidated = origin.__dict__.setdefault('_invalidated_lightcurves', set())
+        if key in invalidated:
+            return
+        invalidated.add(key)
+    PackedLightcurve.objects.filter(target_id=key[0], source_name=key[1]).delete()
+
+
+@receiver(m2m_changed, sender=TargetList.targets.through)
+def invalidate_list_counts(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        invalidate_target_count(instance.pk)
+    else:
+        # instance is a target; pk_set is None when clearing all its lists
+        list_ids = pk_set if pk_set is not None else instance.targetlist_set.values_list('id', flat=True)
+        for list_id in list_ids:
+            invalidate_target_count(list_id)
+
+
+@receiver(post_save, sender=Target)
+def invalidate_created_target_count(sender, instance, created, **kwargs):
+    if created:
+        invalidate_target_count('all')
+
+
+@receiver(pre_delete, sender=Target)
+def invalidate_deleted_target_counts(sender, instance, **kwargs):
+    """Cascade deletes of list memberships send no m2m_changed."""
+    invalidate_target_count('all')
+    for list_id in instance.targetlist_set.values_list('id', flat=True):
+        invalidate_target_count(list_id)
+
+
+@receiver(m2m_changed, sender=TargetList.targets.through)
+def update_project_summaries(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep ProjectSummary rows in step with list membership. Additions
+    are read after they happen, removals before, so both see the
+    targets as members.
+    """
+    if action == 'post_add':
+        if not reverse:
+            project_summary.add_targets(instance.pk, Target.objects.filter(id__in=pk_set))
+        else:
+            for list_id in pk_set:
+                project_summary.add_targets(list_id, Target.objects.filter(id=instance.pk))
+    elif action == 'pre_remove':
+        if not reverse:
+            project_summary.remove_targets(instance.pk, project_summary.project_targets(instance.pk, pk_set))
+        else:
+            for list_id in pk_set:
+                project_summary.remove_targets(list_id, project_summary.project_targets(list_id, [instance.pk]))
+    elif action == 'pre_clear':
+        if not reverse:
+            project_summary.clear_summary(instance.pk)
+        else:
+            for list_id in instance.targetlist_set.values_list('id', flat=True):
+                project_summary.remove_targets(list_id, Target.objects.filter(id=instance.pk))
+
+
+@receiver(pre_delete, sender=Target)
+def remove_deleted_target_from_summaries(sender, instance, **kwargs):
+    for list_id in instance.targetlist_set.values_list('id', flat=True):
+        project_summary.remove_targets(list_id, Target.objects.filter(id=instance.pk))
+
+
+@receiver(post_save, sender=PhotometrySyncState)
+def record_ingested_alert(sender, instance, **kwargs):
+    if instance.last_mjd is not None:
+        project_summary.record_alert_mjd(instance.target_id, instance.last_mjd)
+
+
+@receiver(post_save, sender=ProjectTargetList)
+def create_project_summary(sender, instance, created, **kwargs):
+    """New projects start with an empty summary, so their pages never
+    have to build one.
+    """
+    if created:
+        ProjectSummary.objects.create(
+            project_id=instance.pk, type_counts={}, sky_histogram=project_summary.empty_sky_histogram()
+        )
+
+
+@receiver(pre_save, sender=Target)
+def remember_target_position(sender, instance, **kwargs):
+    if not instance._state.adding:
+        old = Target.objects.filter(pk=instance.pk).values_list('ra', 'dec', 'type').first()
+        instance._summary_position = project_summary.sky_position(*old) if old is not None else None
+
+
+@receiver(post_save, sender=Target)
+def move_target_in_summaries(sender, instance, created, **kwargs):
+    """Project sky histograms follow a target whose ra, dec or type changed."""
+    old = instance.__dict__.pop('_summary_position', None)
+    new = project_summary.sky_position(instance.ra, instance.dec, instance.type)
+    if not created and old is not None and old != new:
+        project_summary.replace_target(instance.pk, (*old, None), (*new, None))
+
+
+@receiver(pre_save, sender=TargetExtra)
+def remember_sn_type(sender, instance, **kwargs):
+    if instance.key == project_summary.SN_TYPE_EXTRA and instance.pk is not None:
+        instance._summary_sn_type = TargetExtra.objects.filter(pk=instance.pk).values_list('value', flat=True).first()
+
+
+def _change_sn_type(target_id, old, new):
+    old = old or project_summary.UNKNOWN_TYPE
+    new = new or project_summary.UNKNOWN_TYPE
+    if old != new:
+        project_summary.replace_target(target_id, (None, None, old), (None, None, new))
+
+
+@receiver(post_save, sender=TargetExtra)
+def save_sn_type_in_summaries(sender, instance, **kwargs):
+    """Project type counts follow saves of a target's SN type extra."""
+    if instance.key == project_summary.SN_TYPE_EXTRA:
+        _change_sn_type(instance.target_id, instance.__dict__.pop('_summary_sn_type', None), instance.value)
+
+
+@receiver(post_delete, sender=TargetExtra)
+def delete_sn_type_from_summaries(sender, instance, origin=None, **kwargs):
+    """A target's own delete is handled by remove_deleted_target_from_summaries."""
+    if instance.key == project_summary.SN_TYPE_EXTRA and not isinstance(origin, Target):
+        _change_sn_type(instance.target_id, instance.value, None)
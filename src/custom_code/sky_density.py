@@ -0,0 +1,86 @@
+import hashlib
+
+import numpy as np
+from astropy import units as u
+from astropy_healpix import healpix_to_lonlat, lonlat_to_healpix, nside_to_npix
+from django.conf import settings
+from django.core.cache import cache
+from tom_targets.models import Target
+
+from custom_code.pagination import PAGE_PARAMS, TARGET_COUNT_TTL, count_version
+
+# maps of more targets than this are binned instead of plotted per target
+SKY_DENSITY_MAX_POINTS = getattr(settings, 'SKY_DENSITY_MAX_POINTS', 5000)
+# nested HEALPix resolution of binned maps; 16 gives 3072 pixels of ~3.7 deg
+SKY_DENSITY_NSIDE = getattr(settings, 'SKY_DENSITY_NSIDE', 16)
+
+
+def healpix_counts(ra, dec, nside=SKY_DENSITY_NSIDE):
+    """Number of the ra, dec positions (in degrees) falling in each
+    nested HEALPix pixel, as an array with one entry per pixel.
+    """
+    ra = np.asarray(ra, dtype=float)
+    dec = np.asarray(dec, dtype=float)
+    if len(ra) == 0:
+        return np.zeros(nside_to_npix(nside), dtype=int)
+    pixels = lonlat_to_healpix(ra * u.deg, dec * u.deg, nside, order='nested')
+    return np.bincount(pixels, minlength=nside_to_npix(nside))
+
+
+def density_map(counts, nside=SKY_DENSITY_NSIDE):
+    """JSON-ready centers and counts of the non-empty pixels of counts."""
+    counts = np.asarray(counts)
+    pixels = np.flatnonzero(counts)
+    lon, lat = healpix_to_lonlat(pixels, nside, order='nested')
+    return {
+        'mode': 'density',
+        'total': int(counts.sum()),
+        'nside': nside,
+        'pixel': pixels.tolist(),
+        'ra': np.round(lon.deg, 4).tolist(),
+        'dec': np.round(lat.deg, 4).tolist(),
+        'count': counts[pixels].tolist(),
+    }
+
+
+def mappable_targets(targets):
+    """The targets of the queryset targets that sky maps show."""
+    return targets.filter(type=Target.SIDEREAL, ra__isnull=False, dec__isnull=False).order_by()
+
+
+def sky_density(targets, max_points=SKY_DENSITY_MAX_POINTS, nside=SKY_DENSITY_NSIDE):
+    """Sky map of the sidereal targets in the queryset targets: their
+    positions and names when there are at most max_points, else counts
+    per HEALPix pixel from one ra, dec query binned with NumPy.
+    """
+    targets = mappable_targets(targets)
+    coords = np.array(targets.values_list('ra', 'dec'), dtype=float).reshape(-1, 2)
+    if len(coords) > max_points:
+        return density_map(healpix_counts(coords[:, 0], coords[:, 1], nside), nside)
+
+    rows = list(targets.values_list('ra', 'dec', 'name'))
+    return {
+        'mode': 'points',
+        'total': len(rows),
+        'ra': [row[0] for row in rows],
+        'dec': [row[1] for row in rows],
+        'name': [row[2] for row in rows],
+    }
+
+
+def cached_sky_density(user, params, targets):
+    """sky_density of targets, cached per user and filter parameters.
+    The entry is invalidated by membership changes of the filtered
+    project, or by any target being added or deleted when no project
+    is filtered.
+    """
+    filters = sorted((key, value) for key, value in params.items() if value and key not in PAGE_PARAMS)
+    project = params.get('targetlist__name', '')
+    scope = int(project) if project.isdigit() else 'all'
+    filter_hash = hashlib.sha1(repr(filters).encode()).hexdigest()
+    key = f'sky_density:{scope}:{count_version(scope)}:{user.pk}:{filter_hash}'
+    result = cache.get(key)
+    if result is None:
+        result = sky_density(targets)
+        cache.set(key, result, TARGET_COUNT_TTL)
+    return result
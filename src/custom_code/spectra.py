@@ -0,0 +1,58 @@
+import warnings
+
+import numpy as np
+from django.conf import settings
+
+HOST_SPECTRUM_MAX_POINTS = getattr(settings, 'HOST_SPECTRUM_MAX_POINTS', 2000)
+
+
+def log_linear_wavelengths(coeff0, coeff1, n_pixels):
+    """Wavelength grid of a log-linear spectrum, where pixel i
+    has log10(wavelength) = coeff0 + i * coeff1.
+    """
+    return 10. ** (coeff0 + coeff1 * np.arange(n_pixels, dtype=float))
+
+
+def decode_ned_spectrum(hdu_list):
+    """Decode one NED spectrum into (wavelength, flux, flux_err) arrays.
+    Row 0 of the primary HDU holds the flux and row 2 its error.
+    """
+    hdu = hdu_list[0]
+    data = np.asarray(hdu.data, dtype=float)
+    flux = data[0]
+    flux_err = data[2]
+    wv = log_linear_wavelengths(hdu.header["COEFF0"], hdu.header["COEFF1"], flux.shape[-1])
+    return wv, flux, flux_err
+
+
+def _block_reduce(values, block, func):
+    """Apply func over consecutive blocks of length block,
+    padding the last block with NaN.
+    """
+    n_pad = -len(values) % block
+    padded = np.concatenate((values, np.full(n_pad, np.nan)))
+    with warnings.catch_warnings():
+        # blocks that are entirely NaN legitimately reduce to NaN
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        return func(padded.reshape(-1, block), axis=1)
+
+
+def downsample_spectrum(wv, flux, flux_err=None, max_points=HOST_SPECTRUM_MAX_POINTS):
+    """Average a spectrum into at most max_points bins of equal
+    pixel count. Errors are combined in quadrature. Spectra that
+    are already small enough are returned unchanged.
+    """
+    wv = np.asarray(wv, dtype=float)
+    flux = np.asarray(flux, dtype=float)
+    if flux_err is not None:
+        flux_err = np.asarray(flux_err, dtype=float)
+    if max_points <= 0 or len(flux) <= max_points:
+        return wv, flux, flux_err
+
+    block = -(-len(flux) // max_points)
+    wv_binned = _block_reduce(wv, block, np.nanmean)
+    flux_binned = _block_reduce(flux, block, np.nanmean)
+    if flux_err is not None:
+        n_good = _block_reduce(np.isfinite(flux_err).astype(float), block, np.nansum)
+        flux_err = np.sqrt(_block_reduce(flux_err ** 2, block, np.nansum)) / np.maximum(n_good, 1.)
+    return wv_binned, flux_binned, flux_err
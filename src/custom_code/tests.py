@@ -1,3 +1,479 @@
-from django.test import TestCase
+import json
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from guardian.shortcuts import assign_perm
+from tom_dataproducts.models import DataProduct, ReducedDatum
+from tom_observations.models import ObservationRecord
+from tom_targets.models import Target, TargetExtra, TargetName
+
+from custom_code.brokers.antares_complete import ANTARESBroker
+from custom_code.brokers.antares_transport import FakeAntaresTransport
+from custom_code.filter_helper import save_loci_to_group
+from custom_code.filters.engine import FilterEngine
+from custom_code.filters.filter_base import Filter
+from custom_code.filters.filter_helper import FilterRegistry
+from custom_code.hook_queue import enqueue_targets, pending_count, process_batch
+from custom_code.host_cache import prefetch_in_background
+from custom_code.lightcurves import rebuild_packed_lightcurve, target_lightcurve
+from custom_code.management.commands.updatereduceddata import with_retries
+from custom_code.models import (
+    PackedLightcurve,
+    PhotometrySyncState,
+    ProjectSummary,
+    ProjectTargetList,
+    QueryProperty,
+    QuerySet,
+    QueryTag,
+    RequeryJob,
+    TargetHookTask
+)
+from custom_code.project_summary import SN_TYPE_EXTRA, get_project_summary, rebuild_project_summary
+from custom_code.sky_density import density_map, sky_density
+
+# queries allowed for one page of a target or project table
+PAGE_QUERY_BUDGET = 25
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TableQueryBudgetTest(TestCase):
+    """Table pages must not issue queries per row."""
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='admin', password='admin')
+        self.client.force_login(self.user)
+        self.project = ProjectTargetList.objects.create(name='project', tns=False)
+        queryset = QuerySet.objects.create(name='project', project=self.project)
+        QueryTag.objects.create(antares_name='tag', queryset=queryset)
+        QueryProperty.objects.create(antares_name='ra', min_value=0., max_value=360., queryset=queryset)
+
+    def add_targets(self, n):
+        start = Target.objects.count()
+        for i in range(start, start + n):
+            target = Target.objects.create(name=f'target{i}', type=Target.SIDEREAL, ra=float(i), dec=0.)
+            TargetName.objects.create(target=target, name=f'alias{i}')
+            ObservationRecord.objects.create(
+                target=target, facility='LCO', parameters={}, observation_id=str(i), status='PENDING'
+            )
+            DataProduct.objects.create(target=target, product_id=f'product{i}')
+            self.project.targets.add(target)
+
+    def count_queries(self, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def assert_budget(self, url, data=None):
+        self.add_targets(2)
+        n_small, _ = self.count_queries(url, data)
+        self.add_targets(23)
+        n_full, response = self.count_queries(url, data)
+        self.assertLessEqual(n_full, PAGE_QUERY_BUDGET)
+        self.assertEqual(n_small, n_full)
+        return response
+
+    def test_target_list(self):
+        response = self.assert_budget(reverse('targets:list'))
+        self.assertContains(response, 'target0, alias0')
+        target = response.context['object_list'][0]
+        self.assertEqual((target.observation_count, target.dataproduct_count), (1, 1))
+
+    def test_project(self):
+        self.assert_budget(reverse('custom_code:project'), {'targetlist__name': self.project.id})
+
+    def test_project_cold_summary(self):
+        """Projects that predate summaries build theirs on first view,
+        with a number of queries independent of their size.
+        """
+        url = reverse('custom_code:project')
+        data = {'targetlist__name': self.project.id}
+        n_queries = []
+        for n in (2, 23):
+            self.add_targets(n)
+            ProjectSummary.objects.filter(project=self.project).delete()
+            n_cold, response = self.count_queries(url, data)
+            n_queries.append(n_cold)
+            self.assertEqual(response.context['summary'].target_count, Target.objects.count())
+        self.assertEqual(n_queries[0], n_queries[1])
+        self.assertLessEqual(n_queries[1], PAGE_QUERY_BUDGET)
+
+    def test_projects(self):
+        for i in range(10):
+            ProjectTargetList.objects.create(name=f'project{i}', tns=False)
+        self.add_targets(3)
+        n_queries, response = self.count_queries(reverse('custom_code:projects'))
+        self.assertLessEqual(n_queries, PAGE_QUERY_BUDGET)
+        counts = {project.name: project.target_count for project in response.context['object_list']}
+        self.assertEqual(counts['project'], 3)
+        self.assertEqual(counts['project0'], 0)
+
+    def test_deep_page(self):
+        self.add_targets(60)
+        url = reverse('custom_code:project')
+        data = {'targetlist__name': self.project.id}
+        n_first, response = self.count_queries(url, data)
+        seen = [target.id for target in response.context['object_list']]
+        while response.context['next_page_url']:
+            n_queries, response = self.count_queries(url + response.context['next_page_url'])
+            self.assertLessEqual(n_queries, n_first)
+            seen += [target.id for target in response.context['object_list']]
+        expected = list(Target.objects.order_by('-created', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+        response = self.client.get(url + response.context['previous_page_url'])
+        self.assertEqual([target.id for target in response.context['object_list']], expected[25:50])
+
+    def test_count_invalidation(self):
+        self.add_targets(3)
+        url = reverse('custom_code:project')
+        data = {'targetlist__name': self.project.id}
+        self.assertEqual(self.client.get(url, data).context['target_count'], 3)
+        self.project.targets.remove(Target.objects.first())
+        self.assertEqual(self.client.get(url, data).context['target_count'], 2)
+        Target.objects.filter(targetlist=self.project).first().delete()
+        self.assertEqual(self.client.get(url, data).context['target_count'], 1)
+
+    def test_bulk_create_count(self):
+        url = reverse('targets:list')
+        self.add_targets(2)
+        self.assertEqual(self.client.get(url).context['target_count'], 2)
+        Target.objects.bulk_create([Target(name='bulk', type=Target.SIDEREAL, ra=0., dec=0.)])
+        self.assertEqual(self.client.get(url).context['target_count'], 2)
+        call_command('rebuild_project_summaries', stdout=StringIO())
+        self.assertEqual(self.client.get(url).context['target_count'], 3)
+
+
+class ProjectSummaryTest(TestCase):
+    """Incremental summary updates must match a full rebuild."""
+
+    def setUp(self):
+        self.project = ProjectTargetList.objects.create(name='project', tns=False)
+        self.targets = []
+        for i in range(6):
+            target = Target.objects.create(name=f'target{i}', type=Target.SIDEREAL, ra=60. * i, dec=-80. + 30. * i)
+            TargetExtra.objects.create(target=target, key=SN_TYPE_EXTRA, value='SN Ia' if i % 2 else 'SN II')
+            PhotometrySyncState.objects.create(target=target, source_name='ANTARES', last_mjd=60000. + i)
+            self.targets.append(target)
+
+    def assert_matches_rebuild(self):
+        summary = ProjectSummary.objects.get(project=self.project)
+        rebuilt = rebuild_project_summary(self.project)
+        for field in ['target_count', 'newest_alert_mjd', 'type_counts', 'sky_histogram']:
+            self.assertEqual(getattr(summary, field), getattr(rebuilt, field), field)
+        return rebuilt
+
+    def test_incremental_updates(self):
+        self.project.targets.add(*self.targets[:2])
+        get_project_summary(self.project)
+        self.project.targets.add(*self.targets[2:])
+        summary = self.assert_matches_rebuild()
+        self.assertEqual(summary.target_count, 6)
+        self.assertEqual(summary.type_counts, {'SN Ia': 3, 'SN II': 3})
+        self.assertEqual(summary.newest_alert_mjd, 60005.)
+
+        self.project.targets.remove(self.targets[5], self.targets[0])
+        summary = self.assert_matches_rebuild()
+        self.assertEqual(summary.newest_alert_mjd, 60004.)
+
+        self.targets[4].targetlist_set.remove(self.project)
+        self.targets[3].delete()
+        summary = self.assert_matches_rebuild()
+        self.assertEqual(summary.target_count, 2)
+
+        sync_state = PhotometrySyncState.objects.get(target=self.targets[1])
+        sync_state.last_mjd = 60010.
+        sync_state.save()
+        summary = self.assert_matches_rebuild()
+        self.assertEqual(summary.newest_alert_mjd, 60010.)
+
+        self.project.targets.clear()
+        self.assertEqual(get_project_summary(ProjectTargetList.objects.get(id=self.project.id)).target_count, 0)
+
+    def test_target_changes(self):
+        self.project.targets.add(*self.targets)
+        target = self.targets[0]
+        target.ra, target.dec = 200., 45.
+        target.save()
+        self.assert_matches_rebuild()
+
+        extra = TargetExtra.objects.get(target=target, key=SN_TYPE_EXTRA)
+        extra.value = 'SN Ibc'
+        extra.save()
+        summary = self.assert_matches_rebuild()
+        self.assertEqual(summary.type_counts, {'SN Ia': 3, 'SN II': 2, 'SN Ibc': 1})
+
+        extra.delete()
+        summary = self.assert_matches_rebuild()
+        self.assertEqual(summary.type_counts, {'SN Ia': 3, 'SN II': 2, 'Unknown': 1})
+        TargetExtra.objects.create(target=target, key=SN_TYPE_EXTRA, value='SN II')
+        self.assertEqual(self.assert_matches_rebuild().type_counts, {'SN Ia': 3, 'SN II': 3})
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SkyDensityTest(TestCase):
+    """Sky maps are per target when small and HEALPix-binned when large."""
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='admin', password='admin')
+        self.client.force_login(self.user)
+        self.project = ProjectTargetList.objects.create(name='project', tns=False)
+        for i in range(8):
+            target = Target.objects.create(name=f'target{i}', type=Target.SIDEREAL, ra=10. + (i % 2), dec=20.)
+            self.project.targets.add(target)
+        Target.objects.create(name='outsider', type=Target.SIDEREAL, ra=200., dec=-40.)
+
+    def test_points(self):
+        response = self.client.get(reverse('custom_code:sky-density'), {'targetlist__name': self.project.id})
+        data = response.json()
+        self.assertEqual(data['mode'], 'points')
+        self.assertEqual(sorted(data['name']), [f'target{i}' for i in range(8)])
+
+    def test_density(self):
+        data = sky_density(self.project.targets.all(), max_points=3)
+        self.assertEqual(data['mode'], 'density')
+        self.assertEqual(data['total'], 8)
+        self.assertEqual(sum(data['count']), 8)
+        self.assertEqual(data, density_map(get_project_summary(self.project).sky_histogram))
+
+    def test_cache_invalidation(self):
+        url = reverse('custom_code:sky-density')
+        data = {'targetlist__name': self.project.id}
+        self.assertEqual(self.client.get(url, data).json()['total'], 8)
+        self.project.targets.add(Target.objects.get(name='outsider'))
+        self.assertEqual(self.client.get(url, data).json()['total'], 9)
+        self.assertEqual(self.client.get(url).json()['total'], 9)
+
+    @mock.patch('custom_code.views.SKY_DENSITY_MAX_POINTS', 3)
+    def test_summary_map(self):
+        comet = Target.objects.create(name='comet', type=Target.NON_SIDEREAL, ra=10., dec=20.)
+        self.project.targets.add(comet)
+        data = self.client.get(reverse('custom_code:sky-density'), {'targetlist__name': self.project.id}).json()
+        self.assertEqual(data['total'], 8)
+        self.assertEqual(data, density_map(get_project_summary(self.project).sky_histogram))
+
+
+class ProcessReducedDataTest(TestCase):
+    """process_reduced_data accepts a locus or, from the alert UI, a dict."""
+
+    def setUp(self):
+        self.transport = FakeAntaresTransport.synthetic(1, n_alerts=5)
+        self.broker = ANTARESBroker(transport=self.transport)
+        self.locus = self.transport.loci[0]
+        self.target = Target.objects.create(
+            name=self.locus.properties['ztf_object_id'], type=Target.SIDEREAL, ra=self.locus.ra, dec=self.locus.dec
+        )
+
+    def test_dict_alert(self):
+        n_points = self.broker.process_reduced_data(self.target, self.broker.alert_to_dict(self.locus))
+        self.assertEqual(n_points, ReducedDatum.objects.filter(target=self.target).count())
+        self.assertGreater(n_points, 0)
+        self.assertEqual(self.transport.n_locus_requests, 1)
+
+    def test_locus_alert(self):
+        self.assertGreater(self.broker.process_reduced_data(self.target, self.locus), 0)
+        self.assertEqual(self.transport.n_locus_requests, 0)
+
+    def test_unknown_target(self):
+        target = Target.objects.create(name='ZTF00unknown', type=Target.SIDEREAL, ra=0., dec=0.)
+        self.assertEqual(self.broker.process_reduced_data(target), 0)
+        self.assertFalse(PhotometrySyncState.objects.filter(target=target).exists())
+
+
+class WithRetriesTest(TestCase):
+    """updatereduceddata retries transport errors only."""
+
+    def failing(self, error):
+        calls = []
+
+        def func():
+            calls.append(1)
+            raise error
+        return func, calls
+
+    def test_permanent_error(self):
+        func, calls = self.failing(AttributeError("'NoneType' object has no attribute 'alerts'"))
+        with self.assertRaises(AttributeError):
+            with_retries(func, retries=3, backoff=0.)
+        self.assertEqual(len(calls), 1)
+
+    def test_transport_error(self):
+        func, calls = self.failing(requests.ConnectionError())
+        with self.assertRaises(requests.ConnectionError):
+            with_retries(func, retries=3, backoff=0.)
+        self.assertEqual(len(calls), 4)
+
+
+class PackedLightcurveTest(TestCase):
+    """Packed lightcurves keep every filter name and go stale with their
+    ReducedDatum rows.
+    """
+
+    def setUp(self):
+        self.target = Target.objects.create(name='target', type=Target.SIDEREAL, ra=0., dec=0.)
+        for i, band in enumerate(['g', 'ATLAS-orange', 'g', 'ATLAS-cyan'] * 5):
+            ReducedDatum.objects.create(
+                target=self.target, data_type='photometry', source_name='ANTARES',
+                timestamp=datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(days=i),
+                value={'magnitude': 18. + i / 10., 'error': 0.1, 'filter': band}
+            )
+        rebuild_packed_lightcurve(self.target, 'ANTARES')
+
+    def test_filter_names(self):
+        lightcurve = target_lightcurve(self.target, 'ANTARES')
+        self.assertEqual(lightcurve['filter'][:4].tolist(), ['g', 'ATLAS-orange', 'g', 'ATLAS-cyan'])
+        self.assertEqual(len(lightcurve['mjd']), 20)
+
+    def test_edit_invalidates(self):
+        datum = ReducedDatum.objects.filter(target=self.target).first()
+        datum.value = {**datum.value, 'magnitude': 10.}
+        datum.save()
+        self.assertFalse(PackedLightcurve.objects.exists())
+        self.assertIn(10., target_lightcurve(self.target, 'ANTARES')['mag'].tolist())
+        self.assertTrue(PackedLightcurve.objects.exists())
+
+    def test_bulk_delete_invalidates_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            ReducedDatum.objects.filter(target=self.target).delete()
+        self.assertEqual(sum('custom_code_packedlightcurve' in q['sql'] for q in queries), 1)
+        self.assertEqual(len(target_lightcurve(self.target, 'ANTARES')['mjd']), 0)
+
+    def test_target_delete(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.target.delete()
+        self.assertEqual(sum('DELETE FROM "custom_code_packedlightcurve"' in q['sql'] for q in queries), 1)
+        self.assertFalse(PackedLightcurve.objects.exists())
+
+
+class FailingFilter(Filter):
+    def __init__(self):
+        self.name = 'Failing'
+
+    def setup(self):
+        pass
+
+    def run(self, target):
+        raise RuntimeError('filter failed')
+
+
+class ProcessHookQueueTest(TestCase):
+    """A failed batch does not end the drain while tasks remain."""
+
+    def test_drain_after_failure(self):
+        enqueue_targets([
+            Target.objects.create(name=f'target{i}', type=Target.SIDEREAL, ra=0., dec=0.).id for i in range(5)
+        ])
+        batches = []
+
+        def run_batch(engine, targets, raise_errors=False):
+            batches.append(len(targets))
+            if len(batches) == 1:
+                raise RuntimeError('filter failed')
+
+        with mock.patch('custom_code.filters.engine.FilterEngine.run_batch', run_batch):
+            call_command('process_hook_queue', '--batch-size', '2', stdout=StringIO())
+        self.assertEqual(pending_count(), 0)
+        self.assertEqual(sum(batches[1:]), 5)
+
+    def test_failing_filter(self):
+        target = Target.objects.create(name='target', type=Target.SIDEREAL, ra=0., dec=0.)
+        enqueue_targets([target.id])
+        with mock.patch('custom_code.filters.engine.get_filter_registry', lambda: FilterRegistry([FailingFilter])):
+            self.assertEqual(process_batch(FilterEngine()), 0)
+        task = TargetHookTask.objects.get(target=target)
+        self.assertEqual(task.attempts, 1)
+        self.assertIn('filter failed', task.last_error)
+
+
+class RequeryStatusTest(TestCase):
+    """Requery job status is only shown to users who may view targets."""
+
+    def test_permission(self):
+        job = RequeryJob.objects.create()
+        url = reverse('custom_code:requery-status', args=(job.id,))
+        # tom_common's Raise403Middleware sends denied requests to the login page
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(User.objects.create_user(username='user', password='user'))
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(User.objects.create_superuser(username='admin', password='admin'))
+        self.assertEqual(self.client.get(url).json()['id'], job.id)
+
+
+class ProjectLightcurvesTest(TestCase):
+    """Project photometry only includes targets the user may view."""
+
+    def setUp(self):
+        self.project = ProjectTargetList.objects.create(name='project', tns=False)
+        self.targets = [
+            Target.objects.create(name=name, type=Target.SIDEREAL, ra=0., dec=0.) for name in ('visible', 'hidden')
+        ]
+        for target in self.targets:
+            ReducedDatum.objects.create(
+                target=target, data_type='photometry', source_name='ANTARES',
+                timestamp=datetime(2024, 1, 1, tzinfo=timezone.utc),
+                value={'magnitude': 18., 'error': 0.1, 'filter': 'g'}
+            )
+        self.project.targets.add(*self.targets)
+        self.user = User.objects.create_user(username='user', password='user')
+        assign_perm('tom_targets.view_target', self.user, self.targets[0])
+        self.client.force_login(self.user)
+
+    def test_hidden_target(self):
+        url = reverse('custom_code:project-lightcurves', args=(self.project.id,))
+        self.assertEqual(self.client.get(url).json()['target_id'], [self.targets[0].id])
+        stream = b''.join(self.client.get(url, {'stream': 1}).streaming_content).decode()
+        self.assertEqual(
+            [row for line in stream.splitlines() for row in json.loads(line)['target_id']], [self.targets[0].id]
+        )
+
+
+class UnreachableHost:
+    """Host galaxy whose media downloads always fail."""
+    ID = -1
+    name = 'unreachable'
+
+    def __init__(self):
+        self.n_fetches = 0
+
+    def fetch_image(self, filters):
+        self.n_fetches += 1
+        raise requests.ConnectionError('PS1 is down')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class HostPrefetchTest(TestCase):
+    """Failed host prefetches are not retried on every page render."""
+
+    def test_failure_is_cached(self):
+        host = UnreachableHost()
+        prefetch_in_background(host).result()
+        self.assertIsNone(prefetch_in_background(host))
+        self.assertEqual(host.n_fetches, 1)
+
+
+class SaveLociToGroupTest(TestCase):
+    """A failing batch add still puts the addable targets in the project."""
+
+    def test_fallback(self):
+        project = ProjectTargetList.objects.create(name='project', tns=False)
+        targets = [Target.objects.create(name=f'ZTF{i}', type=Target.SIDEREAL, ra=0., dec=0.) for i in range(3)]
+        fetched = [({'properties': {'ztf_object_id': target.name}}, None) for target in targets]
+        manager_cls = type(project.targets)
+        add = manager_cls.add
+
+        def add_or_fail(manager, *objs, **kwargs):
+            if len(objs) > 1 or objs[0] == targets[1]:
+                raise IntegrityError('bad row')
+            return add(manager, *objs, **kwargs)
+
+        with mock.patch.object(manager_cls, 'add', add_or_fail), self.assertLogs('custom_code.filter_helper'):
+            self.assertEqual(save_loci_to_group(project, None, fetched), 2)
+        self.assertEqual(set(project.targets.all()), {targets[0], targets[2]})
@@ -2,12 +2,17 @@ from django.urls import path
 
 from custom_code.views import (
     RequeryBrokerView,
+    RequeryStatusView,
     ProjectView,
     ProjectsView,
     ProjectCreateView,
     ProjectDeleteView,
     TargetDetailView,
+    HostPanelView,
+    HostImageView,
+    ProjectLightcurvesView,
     ProjectEditView,
+    SkyDensityView,
 )
 
 app_name = 'custom_code'
@@ -16,8 +21,14 @@ urlpatterns = [
     path('targets/project/', ProjectView.as_view(), name='project'),
     path('targets/projects/<int:pk>/edit/', ProjectEditView.as_view(), name='edit-project'),
     path('targets/requery_broker/', RequeryBrokerView.as_view(), name='requery-broker'),
+    path('targets/requery_broker/status/', RequeryStatusView.as_view(), name='requery-latest-status'),
+    path('targets/requery_broker/status/<int:pk>/', RequeryStatusView.as_view(), name='requery-status'),
     path('targets/projects/', ProjectsView.as_view(), name='projects'),
     path('targets/projects/create-project/', ProjectCreateView.as_view(), name='create-project'),
     path('targets/projects/<int:pk>/delete/', ProjectDeleteView.as_view(), name='delete-project'),
+    path('targets/projects/<int:pk>/lightcurves/', ProjectLightcurvesView.as_view(), name='project-lightcurves'),
+    path('targets/sky_density/', SkyDensityView.as_view(), name='sky-density'),
     path('targets/<int:pk>/', TargetDetailView.as_view(), name='detail'),
+    path('targets/<int:pk>/host/', HostPanelView.as_view(), name='host-panel'),
+    path('targets/<int:pk>/host/image/', HostImageView.as_view(), name='host-image'),
 ]
@@ -1,31 +1,46 @@
+import json
 from urllib.parse import urlencode
 
-from astropy.time import Time
-from django.http import HttpResponseRedirect
+import numpy as np
+from django.contrib import messages
+from django.db.models import Count
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, get_list_or_404
 from django.urls import reverse
 from django.urls import reverse_lazy
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.safestring import mark_safe
+from django.views import View
 from django.views.generic.base import RedirectView, TemplateView
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import FormView, DeleteView
 from django.views.generic.list import ListView
 from django_filters.views import FilterView
 from guardian.mixins import PermissionListMixin
-from tom_alerts.alerts import get_service_class
+from guardian.shortcuts import get_objects_for_user
 from tom_common.mixins import Raise403PermissionRequiredMixin
 from tom_targets.filters import TargetFilter
 from tom_targets.models import Target, TargetList
 
-from custom_code.filter_helper import (
-    save_alerts_to_group,
-    update_all_hosts
-)
 from custom_code.forms import ProjectForm
+from custom_code.requery_jobs import enqueue_requery_job
+from custom_code.lightcurves import (
+    LIGHTCURVE_COLUMNS,
+    iter_project_lightcurves,
+    project_lightcurves
+)
+from custom_code.pagination import KeysetPaginationMixin, cached_target_count, filter_scope
+from custom_code.project_summary import get_project_summary
+from custom_code.sky_density import SKY_DENSITY_MAX_POINTS, cached_sky_density, density_map, mappable_targets
+from custom_code.host_cache import get_host_cache, prefetch_in_background
+from custom_code.spectra import HOST_SPECTRUM_MAX_POINTS, downsample_spectrum
 from custom_code.models import (
+    ProjectSummary,
     ProjectTargetList,
     QuerySet,
     QueryProperty,
     QueryTag,
+    RequeryJob,
     SNType
 )
 
@@ -207,6 +222,16 @@ def save_params_as_queryset(parameters, project):
         anom_prop.save()
 
 
+def annotate_target_table(queryset):
+    """Adds the per-row counts and aliases that target_table.html shows,
+    so a page of targets costs a fixed number of queries.
+    """
+    return queryset.annotate(
+        observation_count=Count('observationrecord', distinct=True),
+        dataproduct_count=Count('dataproduct', distinct=True)
+    ).prefetch_related('aliases')
+
+
 class AboutView(TemplateView):
     template_name = 'about.html'
 
@@ -214,7 +239,7 @@ class AboutView(TemplateView):
         return {'targets': Target.objects.all()}
 
 
-class TargetListView(PermissionListMixin, FilterView):
+class TargetListView(KeysetPaginationMixin, PermissionListMixin, FilterView):
     """
     View for listing targets in the TOM. Only shows targets that the user is authorized to view. Requires authorization.
     """
@@ -226,6 +251,9 @@ class TargetListView(PermissionListMixin, FilterView):
     permission_required = 'tom_targets.view_target'
     ordering = ['-created']
 
+    def get_queryset(self):
+        return annotate_target_table(super().get_queryset())
+
     def get_context_data(self, *args, **kwargs):
         """
         Adds the number of targets visible, the available ``TargetList`` objects if the user is authenticated, and
@@ -245,7 +273,7 @@ class TargetListView(PermissionListMixin, FilterView):
         return context
 
 
-class ProjectView(PermissionListMixin, FilterView):
+class ProjectView(KeysetPaginationMixin, PermissionListMixin, FilterView):
     """
     View for targets in a project in the TOM. Only shows targets that the user is authorized to view.
     Requires authorization.
@@ -258,6 +286,9 @@ class ProjectView(PermissionListMixin, FilterView):
     permission_required = 'tom_targets.view_target'
     ordering = ['-created']
 
+    def get_queryset(self):
+        return annotate_target_table(super().get_queryset())
+
     def get_context_data(self, *args, **kwargs):
         """
         Adds the number of targets visible, the available ``TargetList`` objects if the user is authenticated, and
@@ -274,11 +305,20 @@ class ProjectView(PermissionListMixin, FilterView):
                                 else ProjectTargetList.objects.none())
         context['query_string'] = self.request.META['QUERY_STRING']
         targetlist_name = self.request.GET.get('targetlist__name', '')
-        context['project'] = get_object_or_404(ProjectTargetList, id=targetlist_name)
-        context['queryset'] = get_object_or_404(QuerySet, project=context['project'])
-        context['querytags'] = get_list_or_404(QueryTag, queryset=context['queryset'])
-        context['querypropertys'] = get_list_or_404(QueryProperty, queryset=context['queryset'])
+        context['project'] = get_object_or_404(
+            ProjectTargetList.objects.select_related('summary', 'queryset').prefetch_related(
+                'queryset__tags', 'queryset__properties', 'sn_types'
+            ),
+            id=targetlist_name
+        )
+        try:
+            context['queryset'] = context['project'].queryset
+        except QuerySet.DoesNotExist:
+            raise Http404('Project has no query set.')
+        context['querytags'] = context['queryset'].tags.all()
+        context['querypropertys'] = context['queryset'].properties.all()
         context['sn_types'] = context['project'].sn_types.all()
+        context['summary'] = get_project_summary(context['project'])
         return context
 
 
@@ -291,6 +331,9 @@ class ProjectsView(ListView):
     model = ProjectTargetList
     paginate_by = 25
 
+    def get_queryset(self):
+        return super().get_queryset().annotate(target_count=Count('targets')).order_by('-created', 'name')
+
     def get_context_data(self, **kwargs):
         """
         Formats the list of chosen SN types for each project.
@@ -417,19 +460,56 @@ class ProjectDeleteView(DeleteView):
 
 
 class RequeryBrokerView(RedirectView):
+    """
+    Queues a requery of all projects for the run_requery_jobs worker. Clicks
+    while a requery is queued or running join that job instead of adding one.
+    """
 
     def get(self, request, *args, **kwargs):
-        current_mjd = Time.now().mjd
+        job, created = enqueue_requery_job()
+        status_url = reverse('custom_code:requery-status', args=(job.id,))
+        if created:
+            messages.info(request, mark_safe(
+                f'Requery queued. <a href="{status_url}">Check its progress.</a>'
+            ))
+        else:
+            messages.info(request, mark_safe(
+                f'A requery is already {job.status}. <a href="{status_url}">Check its progress.</a>'
+            ))
 
-        broker_name = 'ANTARES'  # hard-coded for now
-        broker = get_service_class(broker_name)()
+        return HttpResponseRedirect(reverse_lazy('custom_code:projects'))
 
-        for project in ProjectTargetList.objects.all():
-            save_alerts_to_group(project, broker)
 
-        update_all_hosts()
+class RequeryStatusView(Raise403PermissionRequiredMixin, View):
+    """
+    JSON status of a requery job, or of the latest one.
+    """
+    permission_required = 'tom_targets.view_target'
 
-        return HttpResponseRedirect(reverse_lazy('custom_code:projects'))
+    def get(self, request, *args, **kwargs):
+        if 'pk' in kwargs:
+            job = get_object_or_404(RequeryJob, pk=kwargs['pk'])
+        else:
+            job = RequeryJob.objects.order_by('-created').first()
+            if job is None:
+                raise Http404('No requery has been run.')
+
+        failed = [name for name, result in job.projects.items() if 'error' in result]
+        return JsonResponse({
+            'id': job.id,
+            'status': job.status,
+            'created': job.created,
+            'started': job.started,
+            'finished': job.finished,
+            'elapsed': job.elapsed(),
+            'projects_total': ProjectTargetList.objects.count(),
+            'projects_done': len(job.projects),
+            'projects_failed': failed,
+            'alerts': sum(result.get('alerts', 0) for result in job.projects.values()),
+            'projects': job.projects,
+            'hosts': job.hosts,
+            'error': job.error,
+        })
 
 
 class TargetDetailView(Raise403PermissionRequiredMixin, DetailView):
@@ -493,3 +573,151 @@ class TargetDetailView(Raise403PermissionRequiredMixin, DetailView):
                         args=(obs_template.facility,)) + f'?target_id={self.get_object().id}&' + params)
 
         return super().get(request, *args, **kwargs)
+
+
+def _finite_or_none(values):
+    """Float array as a JSON-ready list, with NaN and inf as null."""
+    return np.where(np.isfinite(values), values, None).tolist()
+
+
+class HostPanelView(Raise403PermissionRequiredMixin, View):
+    """
+    JSON for the host tab of the target page, loaded after the page itself.
+    Only reads from the host media cache; misses are fetched in the background
+    and reported as pending, so the response is never blocked on NED or PS1.
+    """
+    permission_required = 'tom_targets.view_target'
+
+    def get(self, request, *args, **kwargs):
+        target = get_object_or_404(Target.objects.select_related('aux_info__host'), pk=kwargs['pk'])
+        aux_info = getattr(target, 'aux_info', None)
+        host = aux_info.host if aux_info is not None else None
+        if host is None:
+            return JsonResponse({'host': None})
+
+        try:
+            max_points = int(request.GET.get('max_points', HOST_SPECTRUM_MAX_POINTS))
+        except ValueError:
+            max_points = HOST_SPECTRUM_MAX_POINTS
+
+        cache = get_host_cache()
+        etag = cache.etag(host.ID)
+        if etag is None:
+            prefetch_in_background(host)
+        else:
+            # responses differ by resolution, so it is part of the validator
+            etag = f'{etag[:-1]}:{max_points}"'
+            response = get_conditional_response(request, etag=etag)
+            if response is not None:
+                return response
+
+        spectra = cache.get_spectra(host.ID) or []
+        response = JsonResponse({
+            'host': {
+                'name': host.name,
+                'ra': host.ra,
+                'dec': host.dec,
+            },
+            'pending': etag is None,
+            'image_url': reverse('custom_code:host-image', args=(target.id,)) if etag else None,
+            'spectra': [
+                {'wavelength': _finite_or_none(wv), 'flux': _finite_or_none(flux)}
+                for wv, flux, _ in (
+                    downsample_spectrum(wv, flux, max_points=max_points) for wv, flux, _ in spectra
+                )
+            ],
+        })
+        if etag is None:
+            patch_cache_control(response, private=True, no_cache=True)
+        else:
+            response['ETag'] = etag
+            patch_cache_control(response, private=True, max_age=3600)
+        return response
+
+
+class HostImageView(Raise403PermissionRequiredMixin, View):
+    """
+    Cached PNG cutout of the host of a target.
+    """
+    permission_required = 'tom_targets.view_target'
+
+    def get(self, request, *args, **kwargs):
+        target = get_object_or_404(Target.objects.select_related('aux_info__host'), pk=kwargs['pk'])
+        aux_info = getattr(target, 'aux_info', None)
+        host = aux_info.host if aux_info is not None else None
+        if host is None:
+            raise Http404('Target has no host galaxy.')
+
+        cache = get_host_cache()
+        etag = cache.etag(host.ID)
+        if etag is not None:
+            response = get_conditional_response(request, etag=etag)
+            if response is not None:
+                return response
+
+        image_png = cache.get_image(host.ID)
+        if image_png is None:
+            prefetch_in_background(host)
+            raise Http404('Host image is not cached yet.')
+
+        response = HttpResponse(image_png, content_type='image/png')
+        if etag is not None:
+            response['ETag'] = etag
+        patch_cache_control(response, private=True, max_age=86400)
+        return response
+
+
+def _lightcurves_to_json(lightcurves):
+    """Column arrays as JSON-ready lists, with NaN as null."""
+    data = {}
+    for col in LIGHTCURVE_COLUMNS:
+        values = lightcurves[col]
+        data[col] = _finite_or_none(values) if values.dtype.kind == 'f' else values.tolist()
+    return data
+
+
+class ProjectLightcurvesView(View):
+    """
+    Columnar photometry of every target in a project that the user may
+    view, restricted per target like ProjectView's rows. With ?stream=1
+    the response is newline-delimited JSON, one object of columns per
+    chunk.
+    """
+
+    def get(self, request, *args, **kwargs):
+        project = get_object_or_404(ProjectTargetList, pk=kwargs['pk'])
+        targets = get_objects_for_user(request.user, 'tom_targets.view_target')
+        if request.GET.get('stream'):
+            chunks = (
+                json.dumps(_lightcurves_to_json(chunk)) + '\n'
+                for chunk in iter_project_lightcurves(project, targets=targets)
+            )
+            return StreamingHttpResponse(chunks, content_type='application/x-ndjson')
+        return JsonResponse(_lightcurves_to_json(project_lightcurves(project, targets=targets)))
+
+
+class SkyDensityView(Raise403PermissionRequiredMixin, View):
+    """
+    Sky map of the targets matching the target filter in the query
+    string: their positions up to SKY_DENSITY_MAX_POINTS, HEALPix
+    counts above it.
+    """
+    permission_required = 'tom_targets.view_target'
+
+    def get(self, request, *args, **kwargs):
+        targets = TargetFilter(
+            request.GET, queryset=get_objects_for_user(request.user, 'tom_targets.view_target'), request=request
+        ).qs
+
+        # an unfiltered project the user sees in full is mapped by its summary,
+        # whose histogram holds the same sidereal targets with positions
+        scope = filter_scope(request.GET)
+        if isinstance(scope, int):
+            summary = ProjectSummary.objects.filter(project_id=scope).first()
+            n_mapped = sum(summary.sky_histogram) if summary is not None else 0
+            if n_mapped > SKY_DENSITY_MAX_POINTS and n_mapped == cached_target_count(
+                scope, request.user, mappable_targets(targets), name='sky_target_count'
+            ):
+                return JsonResponse(density_map(summary.sky_histogram))
+
+        return JsonResponse(cached_sky_density(request.user, request.GET, targets))
@@ -10,6 +10,7 @@ https://docs.djangoproject.com/en/2.1/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.1/ref/settings/
 """
+import importlib.util
 import logging.config
 import os
 import tempfile
@@ -160,7 +161,11 @@ DATE_FORMAT = 'Y-m-d'
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, '_static')
-STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
+STATICFILES_DIRS = [
+    os.path.join(BASE_DIR, 'static'),
+    # plotly.js bundled with the plotly package, served as plotly/plotly.min.js
+    ('plotly', os.path.join(os.path.dirname(importlib.util.find_spec('plotly').origin), 'package_data')),
+]
 MEDIA_ROOT = os.path.join(BASE_DIR, 'data')
 MEDIA_URL = '/data/'
 
@@ -292,6 +297,15 @@ TARGET_PERMISSIONS_ONLY = True
 # for example: OPEN_URLS = ['/', '/about']
 OPEN_URLS = []
 
+# Seconds a cached target count (target list, project pages, sky maps) is trusted. Counts are invalidated when targets
+# are created or deleted and when list membership changes, but not by Target.objects.bulk_create, QuerySet.update or
+# permission changes; those stay stale until this expires or rebuild_project_summaries is run.
+TARGET_COUNT_TTL = 300
+
+# Filters run on saved targets, as dotted paths to Filter subclasses. None run unless listed here.
+# For example: TARGET_FILTERS = ['custom_code.filters.test_filter.TestFilter']
+TARGET_FILTERS = []
+
 HOOKS = {
     'target_post_save': 'custom_code.hooks.target_post_save',
     'observation_change_state': 'tom_common.hooks.observation_change_state',
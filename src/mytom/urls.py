@@ -19,9 +19,11 @@ Including another URLconf
 from django.urls import path, include
 import os
 import sys
-from custom_code.views import AboutView
+from custom_code.views import AboutView, TargetListView
 
 urlpatterns = [
+    # ahead of tom_common so the target list uses the annotated queryset
+    path('targets/', TargetListView.as_view()),
     path('', include('tom_common.urls')),
     path('about/', AboutView.as_view(template_name='about.html'), name='about'),
     path('', include('custom_code.urls')),
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mytom.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if getattr(settings, 'GHOST_PRELOAD', False):
+    from custom_code.ghost import preload_ghost_catalog
+    preload_ghost_catalog()